@@ -0,0 +1,219 @@
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(ROOT_DIR, ".build", "bench")
+OUTPUT_FILE = os.path.join(ROOT_DIR, "bench_output.txt")
+COPY_IGNORE = shutil.ignore_patterns(".git", ".build", "__pycache__", "node_modules", "old_pages", "*.part")
+
+PASSWORD = "bench"
+SEED = 1234
+SCENARIOS = ["pages", "images", "api_list", "api_load", "api_save"]
+
+# --- СТЕНД ---
+# Сервер запускается на копии сайта во временной папке: /api/save не трогает
+# рабочее дерево, а корпус (страницы и resources/) одинаков от прогона к прогону.
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Пароль задаётся копией server.py в отдельном процессе: импорт модуля создаёт
+# .build/ и читает nanocms.json рядом с собой, рабочее дерево не трогаем
+SET_PASSWORD = """
+import json, sys, server
+config = dict(server.security.config, password_hash=server.security.hash_password(sys.argv[1]))
+with open("nanocms.json", "w") as f:
+    json.dump(config, f, indent=4)
+"""
+
+def prepare_site(target):
+    shutil.copytree(ROOT_DIR, target, ignore=COPY_IGNORE)
+    subprocess.run([sys.executable, "-c", SET_PASSWORD, PASSWORD], cwd=target, check=True,
+                   stdout=subprocess.DEVNULL)
+
+def start_server(site, port, extra_args):
+    cmd = [sys.executable, "server.py", "--port", str(port), "--bind", "127.0.0.1"] + extra_args
+    proc = subprocess.Popen(cmd, cwd=site, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2): return proc
+        except OSError: time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def login(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("POST", "/login", body=json.dumps({"password": PASSWORD}))
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie") or ""
+    conn.close()
+    if not cookie: raise RuntimeError("login failed")
+    return cookie.split(";")[0].strip()
+
+def rss_kb(pid):
+    # Только Linux; на других системах RSS не показываем.
+    # С --processes считаем мастер вместе с воркерами.
+    total = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): total = int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                total += rss_kb(int(child)) or 0
+    except OSError: pass
+    return total
+
+# --- СЦЕНАРИИ ---
+
+def corpus(site):
+    pages = sorted(n for n in os.listdir(site) if n.endswith(".html"))
+    res = os.path.join(site, "resources")
+    images = sorted((n for n in os.listdir(res) if os.path.splitext(n)[1].lower() in {".jpg", ".jpeg", ".png", ".webp"}),
+                    key=lambda n: -os.path.getsize(os.path.join(res, n)))[:5]
+    return pages, ["resources/" + n for n in images]
+
+def make_requests(scenario, site, count, rng):
+    # Список (method, path, body) — одинаковый при одинаковом seed
+    pages, images = corpus(site)
+    if scenario == "pages":
+        return [("GET", "/" + rng.choice(pages), None) for _ in range(count)]
+    if scenario == "images":
+        return [("GET", "/" + rng.choice(images), None) for _ in range(count)]
+    if scenario == "api_list":
+        return [("GET", "/api/list", None) for _ in range(count)]
+    if scenario == "api_load":
+        return [("GET", "/api/load?file=" + urllib.parse.quote(rng.choice(pages)), None) for _ in range(count)]
+    if scenario == "api_save":
+        # Сохраняем страницу с тем же содержимым, что и было — сайт не меняется
+        out = []
+        for _ in range(count):
+            page = rng.choice(pages)
+            with open(os.path.join(site, page), "r", encoding="utf-8") as f:
+                out.append(("POST", "/api/save", json.dumps({"file": page, "content": f.read()})))
+        return out
+    raise ValueError(scenario)
+
+def client(port, cookie, jobs, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    headers = {"Cookie": cookie, "Accept-Encoding": "gzip"}
+    for method, path, body in jobs:
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 400: errors.append(resp.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+def percentile(sorted_values, p):
+    if not sorted_values: return None
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+def run_scenario(port, cookie, jobs, clients):
+    latencies, errors = [], []
+    # Запросы раздаются клиентам по кругу; у каждого клиента одно keep-alive соединение
+    parts = [jobs[i::clients] for i in range(clients)]
+    threads = [threading.Thread(target=client, args=(port, cookie, part, latencies, errors)) for part in parts]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(jobs),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50": ms(percentile(latencies, 50)),
+        "p95": ms(percentile(latencies, 95)),
+        "p99": ms(percentile(latencies, 99)),
+        "max": ms(latencies[-1] if latencies else None),
+    }
+
+# --- ОТЧЁТ ---
+
+def format_report(results, baseline=None):
+    lines = [f"{'scenario':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'rss KB':>9}"]
+    for name, r in results["scenarios"].items():
+        row = f"{name:<10} {r['rps']:>9} {r['p50']:>9} {r['p95']:>9} {r['p99']:>9} {r['errors']:>7} {str(r.get('rss_kb')):>9}"
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old and old.get("rps") and old.get("p95"):
+            row += f"   rps {100 * (r['rps'] - old['rps']) / old['rps']:+.1f}%  p95 {100 * (r['p95'] - old['p95']) / old['p95']:+.1f}%"
+        lines.append(row)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server.py on a copy of the site")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these (default: all)")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured requests per scenario")
+    parser.add_argument("--save", metavar="NAME", help="save results as baseline NAME")
+    parser.add_argument("--compare", metavar="NAME", help="compare with baseline NAME")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("server_args", nargs=argparse.REMAINDER, help="extra server.py arguments after --")
+    args = parser.parse_args()
+    extra = [a for a in args.server_args if a != "--"]
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + ".json"), "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {"time": int(time.time()), "requests": args.requests, "clients": args.clients,
+               "server_args": extra, "scenarios": {}}
+    with tempfile.TemporaryDirectory(prefix="nanocms-bench-") as tmp:
+        site = os.path.join(tmp, "site")
+        prepare_site(site)
+        port = free_port()
+        proc = start_server(site, port, ["--no-precompress"] + extra)
+        try:
+            cookie = login(port)
+            for name in args.scenario or SCENARIOS:
+                rng = random.Random(SEED)
+                if args.warmup:
+                    run_scenario(port, cookie, make_requests(name, site, args.warmup, rng), args.clients)
+                r = run_scenario(port, cookie, make_requests(name, site, args.requests, rng), args.clients)
+                r["rss_kb"] = rss_kb(proc.pid)
+                results["scenarios"][name] = r
+                print(f"{name}: {r['rps']} req/s, p95 {r['p95']} ms", file=sys.stderr)
+        finally:
+            proc.terminate()
+            try: proc.wait(15)
+            except subprocess.TimeoutExpired: proc.kill()
+
+    report = format_report(results, baseline)
+    print(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, args.save + ".json"), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import fingerprint
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "css.json")
+EXCLUDE_DIRS = ["old_pages", "components", "resources"]
+
+STYLE_FILE = "style.css"
+SCRIPT_FILES = ["main.js", "accessibility.js"]
+CONFIG_FILE = "tailwind-config.js"  # тема сайта: tailwind.config = {theme: ...} для CDN-рантайма
+
+CDN_TAG = re.compile(r'(?:[ \t]*<!-- Tailwind CSS -->[ \t]*\n)?[ \t]*<script src="https://cdn\.tailwindcss\.com[^"]*"></script>[ \t]*\n?')
+CONFIG_TAG = re.compile(r'[ \t]*<script src="tailwind-config\.js(?:\?v=[0-9a-f]*)?"></script>[ \t]*\n?')
+STYLE_LINK = re.compile(r'<link\b[^>]*href="(?:style\.css(?:\?v=[0-9a-f]*)?|site\.[0-9a-f]{10}\.css)"[^>]*>')
+BUNDLE_NAME = re.compile(r'^site\.[0-9a-f]{10}\.css$')
+CLASS_ATTR = re.compile(r'\bclass\s*=\s*(["\'])(.*?)\1', re.DOTALL)
+
+lock = threading.Lock()
+
+def list_pages():
+    pages = []
+    for root, dirs, files in os.walk(ROOT_DIR):
+        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                pages.append(os.path.join(root, file))
+    return sorted(pages)
+
+def page_classes(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return {c for m in CLASS_ATTR.finditer(content) for c in m.group(2).split()}
+
+def input_hashes():
+    hashes = {}
+    for name in [STYLE_FILE, CONFIG_FILE] + SCRIPT_FILES:
+        path = os.path.join(ROOT_DIR, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                hashes[name] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp = MANIFEST_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, MANIFEST_FILE)
+
+def find_compiler():
+    # Только локальные варианты: standalone-бинарник или node_modules проекта,
+    # чтобы сборка работала без сети
+    exe = os.environ.get("TAILWIND_BIN") or shutil.which("tailwindcss")
+    if exe: return [exe]
+    local = os.path.join(ROOT_DIR, "node_modules", ".bin", "tailwindcss")
+    if os.path.exists(local): return [local]
+    return None
+
+def compile_bundle(pages):
+    compiler = find_compiler()
+    if not compiler:
+        raise RuntimeError("tailwindcss not found: put the standalone binary on PATH, set TAILWIND_BIN or npm install tailwindcss@3")
+    with tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, "tailwind.config.js")
+        content = pages + [os.path.join(ROOT_DIR, s) for s in SCRIPT_FILES]
+        # Тема берётся из того же tailwind-config.js, что читал CDN-рантайм:
+        # файл выполняется как есть, к его tailwind.config добавляется content
+        try:
+            with open(os.path.join(ROOT_DIR, CONFIG_FILE), 'r', encoding='utf-8') as f:
+                site_config = f.read()
+        except OSError:
+            site_config = ""
+        with open(config, 'w', encoding='utf-8') as f:
+            f.write("const tailwind = {};\n" + site_config + "\n")
+            f.write("module.exports = Object.assign({}, tailwind.config, " + json.dumps({"content": content}) + ");\n")
+        source = os.path.join(tmp, "input.css")
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write("@tailwind base;\n@tailwind components;\n@tailwind utilities;\n")
+            with open(os.path.join(ROOT_DIR, STYLE_FILE), 'r', encoding='utf-8') as s:
+                f.write(s.read())
+        out = os.path.join(tmp, "out.css")
+        subprocess.run(compiler + ["-c", config, "-i", source, "-o", out, "--minify"],
+                       check=True, capture_output=True)
+        with open(out, 'rb') as f:
+            css = f.read()
+
+    name = f"site.{hashlib.sha1(css).hexdigest()[:10]}.css"
+    target = os.path.join(ROOT_DIR, name)
+    if not os.path.exists(target):
+        with open(target + '.tmp', 'wb') as f:
+            f.write(css)
+        os.replace(target + '.tmp', target)
+    for old in os.listdir(ROOT_DIR):
+        if BUNDLE_NAME.match(old) and old != name:
+            os.remove(os.path.join(ROOT_DIR, old))
+    return name
+
+def rewrite_page(content, bundle):
+    link = f'<link rel="stylesheet" href="{bundle}">'
+    content = CONFIG_TAG.sub('', CDN_TAG.sub('', content))
+    seen = []
+
+    def repl(m):
+        seen.append(m)
+        return link if len(seen) == 1 else ''
+
+    content = STYLE_LINK.sub(repl, content)
+    if not seen and '</head>' in content:
+        content = content.replace('</head>', f'    {link}\n</head>', 1)
+    return content
+
+def rewrite_file(path, bundle, update=None):
+    # update(path, fn) — как в fingerprint.update_file; сервер пишет через историю
+    return (update or fingerprint.update_file)(path, lambda content: rewrite_page(content, bundle))
+
+def build(force=False, update=None):
+    # Возвращает (имя бандла, список переписанных страниц)
+    with lock:
+        manifest = load_manifest()
+        pages = list_pages()
+        classes = set()
+        for page in pages:
+            classes |= page_classes(page)
+        inputs = input_hashes()
+        bundle = manifest.get("bundle")
+        have_bundle = bundle and os.path.exists(os.path.join(ROOT_DIR, bundle))
+        fresh = have_bundle and classes <= set(manifest.get("classes", [])) and inputs == manifest.get("inputs")
+        same_theme = manifest.get("inputs", {}).get(CONFIG_FILE) == inputs.get(CONFIG_FILE)
+        if not fresh and not force and have_bundle and same_theme and not find_compiler():
+            # Компилятора нет (офлайн-машина) — остаёмся на последнем бандле,
+            # страницы не возвращаются на CDN; новые классы появятся при следующей сборке.
+            # Бандл с другой темой так не оставляем: без компилятора сборка падает
+            sys.stderr.write("tailwindcss not found, keeping " + bundle + "\n")
+        elif force or not fresh:
+            bundle = compile_bundle(pages)
+            save_manifest({"bundle": bundle, "classes": sorted(classes), "inputs": inputs})
+        changed = [p for p in pages if rewrite_file(p, bundle, update)]
+        return bundle, changed
+
+def on_save(path, update=None):
+    # Инкрементальная пересборка после сохранения через CMS.
+    # Пока сайт не переведён на бандл (нет манифеста), ничего не делает.
+    manifest = load_manifest()
+    bundle = manifest.get("bundle")
+    if not bundle: return []
+    name = os.path.relpath(path, ROOT_DIR).replace('\\', '/')
+    if name in [STYLE_FILE, CONFIG_FILE] + SCRIPT_FILES:
+        return build(update=update)[1]
+    if not path.endswith(".html"): return []
+    if os.path.exists(os.path.join(ROOT_DIR, bundle)) and page_classes(path) <= set(manifest.get("classes", [])):
+        with lock:
+            return [path] if rewrite_file(path, bundle, update) else []
+    return build(update=update)[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile Tailwind + style.css into one hashed bundle and link it from every page")
+    parser.add_argument("--force", action="store_true", help="recompile even if nothing changed")
+    args = parser.parse_args()
+    try:
+        bundle, changed = build(args.force)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"Build failed: {getattr(e, 'stderr', None) or e}")
+        sys.exit(1)
+    for path in changed:
+        print(f"Updated {os.path.relpath(path, ROOT_DIR)}")
+    print(f"Bundle: {bundle}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import threading
+
+import fingerprint
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(ROOT_DIR, "templates")
+PAGES_DIR = os.path.join(ROOT_DIR, "pages")
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "pages.json")
+
+# Общие скрипты страниц — уходят в partials/scripts.html
+SHARED_SCRIPTS = ['<script src="main.js"></script>', '<script src="accessibility.js"></script>']
+
+TOKEN = re.compile(r'{%\s*(.*?)\s*%}|{{\s*(.*?)\s*}}', re.DOTALL)
+NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+LAYOUT = """<!DOCTYPE html>
+<html lang="en-US">
+
+<head>
+{% block head %}{% endblock %}
+</head>
+
+<body class="{{ body_class }}">
+
+{% include "partials/header.html" %}
+
+{% block content %}{% endblock %}
+
+{% include "partials/footer.html" %}
+
+{% block after_footer %}{% endblock %}
+
+{% include "partials/scripts.html" %}
+</body>
+
+</html>
+"""
+
+lock = threading.Lock()
+
+class TemplateError(Exception):
+    pass
+
+# --- ШАБЛОНЫ ---
+# Поддерживается подмножество синтаксиса Jinja:
+#   {% extends "layout.html" %}  {% block name %}...{% endblock %}
+#   {% include "partials/x.html" %}  {% set name = "value" %}  {{ name }}
+# Шаблон компилируется в Python-функцию один раз на каждую версию файла.
+
+class Template:
+    def __init__(self, name, source, loader):
+        self.name = name
+        self.parent = None
+        self.vars = {}
+        self.includes = []
+        nodes = self.parse(source)
+        code = Compiler(name).compile(nodes)
+        scope = {}
+        exec(compile(code, f"<template {name}>", "exec"), scope)
+        self.body = scope['render']
+        self.blocks = scope['BLOCKS']
+        self.deps = {loader.path(name)}
+        for dep in ([self.parent] if self.parent else []) + self.includes:
+            self.deps |= loader.get(dep).deps
+
+    def parse(self, source):
+        root = []
+        stack = [('root', root)]
+        pos = 0
+        for m in TOKEN.finditer(source):
+            out = stack[-1][1]
+            if m.start() > pos: out.append(('text', source[pos:m.start()]))
+            pos = m.end()
+            if m.group(2) is not None:
+                name = m.group(2)
+                if not NAME.match(name): raise TemplateError(f"{self.name}: bad variable {{{{ {name} }}}}")
+                out.append(('var', name))
+                continue
+            tag, _, arg = m.group(1).partition(' ')
+            arg = arg.strip()
+            if tag == 'extends':
+                self.parent = arg.strip('"\'')
+            elif tag == 'include':
+                self.includes.append(arg.strip('"\''))
+                out.append(('include', arg.strip('"\'')))
+            elif tag == 'set':
+                key, _, value = arg.partition('=')
+                self.vars[key.strip()] = value.strip().strip('"\'')
+            elif tag == 'block':
+                children = []
+                out.append(('block', arg, children))
+                stack.append((arg, children))
+            elif tag == 'endblock':
+                if len(stack) == 1: raise TemplateError(f"{self.name}: unexpected endblock")
+                stack.pop()
+            else:
+                raise TemplateError(f"{self.name}: unknown tag {tag}")
+        if len(stack) > 1: raise TemplateError(f"{self.name}: unclosed block {stack[-1][0]}")
+        if pos < len(source): root.append(('text', source[pos:]))
+        return root
+
+    def render_into(self, ctx, blocks, loader, out):
+        self.body(ctx, blocks, loader, out)
+
+    def render(self, loader, ctx=None):
+        # Цепочка extends: блоки потомка перекрывают блоки предков
+        chain = [self]
+        while chain[-1].parent:
+            chain.append(loader.get(chain[-1].parent))
+        blocks, context = {}, {}
+        for t in reversed(chain):
+            blocks.update(t.blocks)
+            context.update(t.vars)
+        context.update(ctx or {})
+        out = []
+        chain[-1].render_into(context, blocks, loader, out)
+        return ''.join(out)
+
+class Compiler:
+    def __init__(self, name):
+        self.name = name
+        self.functions = []
+        self.blocks = {}
+
+    def compile(self, nodes):
+        self.function('render', nodes)
+        lines = []
+        for fn in self.functions: lines += fn
+        lines.append('BLOCKS = {' + ', '.join(f'{k!r}: {v}' for k, v in self.blocks.items()) + '}')
+        return '\n'.join(lines) + '\n'
+
+    def function(self, fname, nodes):
+        body = []
+        self.emit(nodes, body)
+        self.functions.append([f'def {fname}(ctx, blocks, loader, out):', '    w = out.append'] + (body or ['    pass']))
+
+    def emit(self, nodes, body):
+        for node in nodes:
+            kind = node[0]
+            if kind == 'text':
+                body.append(f'    w({node[1]!r})')
+            elif kind == 'var':
+                body.append(f'    w(str(ctx.get({node[1]!r}, "")))')
+            elif kind == 'include':
+                body.append(f'    loader.get({node[1]!r}).render_into(ctx, blocks, loader, out)')
+            elif kind == 'block':
+                fname = f'block_{len(self.blocks)}'
+                self.blocks[node[1]] = fname
+                self.function(fname, node[2])
+                body.append(f'    blocks.get({node[1]!r}, {fname})(ctx, blocks, loader, out)')
+
+class Loader:
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.cache = {}  # name -> ({dep path: mtime_ns}, Template)
+
+    def path(self, name):
+        for d in self.dirs:
+            path = os.path.normpath(os.path.join(d, name))
+            if path.startswith(os.path.join(d, '')) and os.path.isfile(path): return path
+        raise TemplateError(f"template not found: {name}")
+
+    def mtime(self, path):
+        try: return os.stat(path).st_mtime_ns
+        except OSError: return None
+
+    def get(self, name):
+        cached = self.cache.get(name)
+        if cached and all(self.mtime(p) == m for p, m in cached[0].items()):
+            return cached[1]
+        with open(self.path(name), 'r', encoding='utf-8') as f:
+            template = Template(name, f.read(), self)
+        self.cache[name] = ({p: self.mtime(p) for p in template.deps}, template)
+        return template
+
+loader = Loader([PAGES_DIR, TEMPLATES_DIR])
+
+# --- СБОРКА ---
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp = MANIFEST_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp, MANIFEST_FILE)
+
+def list_sources():
+    if not os.path.isdir(PAGES_DIR): return []
+    return sorted(f for f in os.listdir(PAGES_DIR) if f.endswith(".html"))
+
+def rel(path):
+    return os.path.relpath(path, ROOT_DIR).replace('\\', '/')
+
+def build_page(name, manifest, force=False, update=None):
+    # True, если страница перезаписана. update(path, fn) — как в fingerprint.update_file;
+    # сервер пишет через историю, и проверка «правили вручную» идёт под той же блокировкой
+    template = loader.get(name)
+    deps = {rel(p): file_hash(p) for p in sorted(template.deps)}
+    out_path = os.path.join(ROOT_DIR, name)
+    entry = manifest.get(name)
+    current = file_hash(out_path) if os.path.exists(out_path) else None
+    if not force and entry and entry['deps'] == deps and current == entry['output']:
+        return False
+    html = template.render(loader, {'page': name})
+    rendered = hashlib.sha1(html.encode('utf-8')).hexdigest()
+    built = []
+
+    def render(content):
+        current = hashlib.sha1(content.encode('utf-8')).hexdigest() if os.path.exists(out_path) else None
+        if rendered == current:
+            # Результат уже на диске (например, его переписал build_css вместе с исходником)
+            built.append(rendered)
+            return content
+        if not force and entry and current and current != entry['output']:
+            # Готовую страницу правили напрямую (например, через CMS) — не затираем молча
+            sys.stderr.write(f"{name} was edited after the last build, skipping (use --force)\n")
+            return content
+        built.append(rendered)
+        return html
+
+    written = (update or fingerprint.update_file)(out_path, render)
+    if built: manifest[name] = {'deps': deps, 'output': rendered}
+    return written
+
+def build(force=False, only=None, update=None):
+    # Возвращает список перезаписанных страниц
+    with lock:
+        manifest = load_manifest()
+        before = json.dumps(manifest, sort_keys=True)
+        changed = []
+        for name in (only or list_sources()):
+            if build_page(name, manifest, force, update):
+                changed.append(os.path.join(ROOT_DIR, name))
+        for name in [n for n in manifest if n not in list_sources()]:
+            del manifest[name]
+        if json.dumps(manifest, sort_keys=True) != before: save_manifest(manifest)
+        return changed
+
+def stamp(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+fresh = {}  # name -> {путь: (mtime_ns, size)} зависимостей и результата при последней сверке
+
+def render_if_stale(name, update=None):
+    # Рендер по запросу (server.py --render-templates): пока stat зависимостей
+    # и готовой страницы прежний, build() с его манифестом и SHA-1 не нужен
+    known = fresh.get(name)
+    if known and all(stamp(p) == s for p, s in known.items()): return []
+    with lock:
+        deps = {p: stamp(p) for p in loader.get(name).deps}
+    changed = build(only=[name], update=update)
+    out_path = os.path.join(ROOT_DIR, name)
+    fresh[name] = {**deps, out_path: stamp(out_path)}
+    return changed
+
+def has_source(name):
+    return os.path.isfile(os.path.join(PAGES_DIR, name))
+
+def on_save(path, update=None):
+    # Правка шаблона или исходника страницы через CMS — пересобираем затронутые страницы
+    if not (path.startswith(os.path.join(TEMPLATES_DIR, '')) or path.startswith(os.path.join(PAGES_DIR, ''))):
+        return []
+    return build(update=update)
+
+# --- ИМПОРТ СУЩЕСТВУЮЩИХ СТРАНИЦ ---
+
+def split_page(content):
+    head = re.search(r'<head>\s*(.*?)\s*</head>', content, re.DOTALL)
+    body = re.search(r'<body([^>]*)>', content)
+    header_end = content.find('</header>')
+    footer_start = content.rfind('\n', 0, content.find('<footer')) + 1
+    footer_end = content.find('</footer>')
+    body_end = content.rfind('</body>')
+    if not head or not body or min(header_end, footer_start, footer_end, body_end) < 0:
+        return None
+    after = content[footer_end + len('</footer>'):body_end]
+    for tag in SHARED_SCRIPTS:
+        # Ссылка может уже нести ?v= от fingerprint.py
+        pattern = re.escape(tag).replace(r'\.js"', r'\.js(?:\?v=[0-9a-f]*)?"')
+        after = re.sub(r'[ \t]*' + pattern + r'[ \t]*\n?', '', after)
+    body_class = re.search(r'class="([^"]*)"', body.group(1))
+    return {
+        'head': head.group(1),
+        'body_class': body_class.group(1) if body_class else '',
+        'header': content[body.end():header_end + len('</header>')].strip('\n'),
+        'content': content[header_end + len('</header>'):footer_start].strip('\n').rstrip(),
+        'footer': content[footer_start:footer_end + len('</footer>')],
+        'after_footer': after.strip('\n'),
+    }
+
+def normalize(s):
+    # Сравнение без учёта переносов и отступов внутри разметки
+    s = re.sub(r'\s+', ' ', s)
+    return re.sub(r'\s*>\s*<\s*', '><', re.sub(r'\s+>', '>', s)).strip()
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def init_templates(sample):
+    # Заготовка layout + partials из одной страницы
+    with open(os.path.join(ROOT_DIR, sample), 'r', encoding='utf-8') as f:
+        parts = split_page(f.read())
+    if not parts: raise TemplateError(f"{sample}: cannot find head/header/footer")
+    write_file(os.path.join(TEMPLATES_DIR, 'layout.html'), LAYOUT)
+    write_file(os.path.join(TEMPLATES_DIR, 'partials', 'header.html'), parts['header'] + '\n')
+    write_file(os.path.join(TEMPLATES_DIR, 'partials', 'footer.html'), parts['footer'] + '\n')
+    write_file(os.path.join(TEMPLATES_DIR, 'partials', 'scripts.html'), ''.join(f'    {t}\n' for t in SHARED_SCRIPTS))
+    print(f"Created templates/ from {sample}")
+
+def import_page(name, force=False):
+    with open(os.path.join(ROOT_DIR, name), 'r', encoding='utf-8') as f:
+        parts = split_page(f.read())
+    if not parts:
+        print(f"Skipping {name}: cannot find head/header/footer")
+        return False
+    for partial in ('header', 'footer'):
+        with open(os.path.join(TEMPLATES_DIR, 'partials', partial + '.html'), 'r', encoding='utf-8') as f:
+            shared = f.read()
+        if normalize(shared) != normalize(parts[partial]) and not force:
+            print(f"Skipping {name}: its {partial} differs from partials/{partial}.html (use --force to replace it)")
+            return False
+    source = (
+        '{% extends "layout.html" %}\n'
+        f'{{% set body_class = "{parts["body_class"]}" %}}\n\n'
+        '{% block head %}\n    ' + parts['head'] + '\n{% endblock %}\n\n'
+        '{% block content %}\n' + parts['content'] + '\n{% endblock %}\n\n'
+        '{% block after_footer %}\n' + parts['after_footer'] + '\n{% endblock %}\n'
+    )
+    write_file(os.path.join(PAGES_DIR, name), source)
+    print(f"Imported {name}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Render pages/*.html through the shared layout in templates/")
+    parser.add_argument("--force", action="store_true", help="re-render everything, overwrite hand-edited output")
+    parser.add_argument("--init", metavar="PAGE", help="create templates/ from an existing page")
+    parser.add_argument("--import", dest="imports", nargs="+", metavar="PAGE", help="convert existing pages into pages/ sources")
+    args = parser.parse_args()
+
+    try:
+        if args.init: init_templates(args.init)
+        if args.imports:
+            imported = [n for n in args.imports if import_page(os.path.basename(n), args.force)]
+            # Импортированные страницы сразу рендерим, чтобы они попали в манифест
+            if imported: build(force=True, only=imported)
+            return
+        changed = build(args.force)
+    except TemplateError as e:
+        print(f"Template error: {e}")
+        sys.exit(1)
+    for path in changed:
+        print(f"Rendered {rel(path)}")
+    print(f"{len(changed)} pages rendered")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = os.path.join(ROOT_DIR, ".build", "fetch.json")
+
+WORKERS = 4
+RETRIES = 3
+TIMEOUT = 30
+CHUNK = 64 * 1024
+MAX_REDIRECTS = 5
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+class FetchError(Exception):
+    pass
+
+class Fetcher:
+    # Пул потоков + постоянное соединение на (поток, хост).
+    # Для каждого URL в манифесте хранятся ETag/Last-Modified, чтобы повторный
+    # запуск скачивал только изменившееся, а оборванная загрузка докачивалась через Range.
+    def __init__(self, manifest_file=MANIFEST_FILE, workers=WORKERS, retries=RETRIES, timeout=TIMEOUT, headers=HEADERS):
+        self.manifest_file = manifest_file
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.headers = dict(headers)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.connections = []
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self):
+        # Пишут несколько потоков — запись на диск по очереди, через один .tmp
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.manifest, indent=4, sort_keys=True)
+            with open(self.manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    # --- СОЕДИНЕНИЯ ---
+
+    def connection(self, scheme, netloc, fresh=False):
+        pool = getattr(self.local, 'pool', None)
+        if pool is None: pool = self.local.pool = {}
+        key = (scheme, netloc)
+        if fresh and key in pool:
+            pool.pop(key).close()
+        if key not in pool:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            pool[key] = cls(netloc, timeout=self.timeout)
+            with self.lock: self.connections.append(pool[key])
+        return pool[key]
+
+    def close(self):
+        # Соединения текущего потока (после ошибки — чтобы повтор шёл по новому)
+        for conn in getattr(self.local, 'pool', {}).values(): conn.close()
+        self.local.pool = {}
+
+    def close_all(self):
+        with self.lock:
+            conns, self.connections = self.connections, []
+        for conn in conns: conn.close()
+
+    def open(self, url, headers=None):
+        # Возвращает (response, итоговый url); тело ответа читает вызывающий
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            hdrs = dict(self.headers, **(headers or {}))
+            for attempt in (0, 1):
+                # Сервер мог закрыть простаивающее keep-alive соединение — переподключаемся один раз
+                conn = self.connection(parts.scheme, parts.netloc, fresh=attempt > 0)
+                try:
+                    conn.request('GET', path, headers=hdrs)
+                    resp = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    if attempt: raise
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+                resp.read()
+                url = urllib.parse.urljoin(url, resp.getheader('Location'))
+                continue
+            return resp, url
+        raise FetchError(f"too many redirects: {url}")
+
+    def with_retries(self, fn, url):
+        delay = 1
+        for attempt in range(self.retries + 1):
+            try: return fn()
+            except (OSError, http.client.HTTPException, FetchError) as e:
+                retryable = not isinstance(e, FetchError) or getattr(e, 'retryable', False)
+                if attempt == self.retries or not retryable: raise
+                self.close()
+                time.sleep(delay)
+                delay *= 2
+
+    def status_error(self, resp, url):
+        resp.read()
+        e = FetchError(f"HTTP {resp.status} for {url}")
+        e.retryable = resp.status == 429 or resp.status >= 500
+        return e
+
+    # --- ЗАГРУЗКА ---
+
+    def get_text(self, url):
+        def run():
+            resp, final = self.open(url)
+            if resp.status != 200: raise self.status_error(resp, final)
+            return resp.read().decode('utf-8', 'replace')
+        return self.with_retries(run, url)
+
+    def fetch(self, url, dest):
+        # 'downloaded' | 'resumed' | 'not-modified'
+        return self.with_retries(lambda: self.fetch_once(url, dest), url)
+
+    def fetch_once(self, url, dest):
+        with self.lock:
+            meta = dict(self.manifest.get(url, {}))
+        part = dest + '.part'
+        headers = {}
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = meta.get('etag') or meta.get('last_modified')
+        if offset and validator:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        elif os.path.exists(dest) and validator:
+            if meta.get('etag'): headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+        else:
+            offset = 0
+
+        resp, final = self.open(url, headers)
+        if resp.status == 304:
+            resp.read()
+            return 'not-modified'
+        if resp.status == 206 and offset:
+            # Дописываем, только если сервер отдал кусок ровно с нашего смещения
+            start = resp.getheader('Content-Range', '').partition(' ')[2].partition('-')[0]
+            if start != str(offset):
+                os.remove(part)
+                e = FetchError(f"unexpected Content-Range {resp.getheader('Content-Range')!r} for {url}")
+                e.retryable = True
+                raise e
+            mode, result = 'ab', 'resumed'
+        elif resp.status == 200:
+            mode, result, offset = 'wb', 'downloaded', 0
+        elif resp.status == 416 and offset:
+            # .part уже целиком — ответ пустой, просто завершаем
+            resp.read()
+            mode, result = None, 'resumed'
+        else:
+            raise self.status_error(resp, final)
+
+        # Валидаторы сохраняем на диск до чтения тела: если процесс оборвётся,
+        # следующий запуск докачает .part с If-Range, а не начнёт заново
+        with self.lock:
+            entry = self.manifest[url] = {
+                'etag': resp.getheader('ETag') or meta.get('etag'),
+                'last_modified': resp.getheader('Last-Modified') or meta.get('last_modified'),
+                'dest': os.path.relpath(dest, ROOT_DIR).replace('\\', '/'),
+            }
+        if entry != meta: self.save_manifest()
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        if mode:
+            with open(part, mode) as f:
+                for chunk in iter(lambda: resp.read(CHUNK), b''):
+                    f.write(chunk)
+            expected = resp.getheader('Content-Length')
+            if expected is not None and os.path.getsize(part) - offset < int(expected):
+                raise FetchError(f"incomplete body for {url}")
+        os.replace(part, dest)
+        return result
+
+    def fetch_all(self, jobs):
+        # jobs: [(url, dest)] -> {url: результат или текст ошибки}
+        results = {}
+
+        def run(job):
+            url, dest = job
+            try: results[url] = self.fetch(url, dest)
+            except Exception as e: results[url] = f"error: {e}"
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(run, jobs))
+        self.close_all()
+        self.save_manifest()
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Download URLs concurrently with resume and conditional re-fetch")
+    parser.add_argument("pairs", nargs="+", metavar="URL=DEST", help="what to download and where")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--manifest", default=MANIFEST_FILE)
+    args = parser.parse_args()
+
+    jobs = []
+    for pair in args.pairs:
+        url, sep, dest = pair.partition('=')
+        if not sep:
+            print(f"Expected URL=DEST, got {pair}")
+            sys.exit(1)
+        jobs.append((url, os.path.abspath(dest)))
+    fetcher = Fetcher(args.manifest, args.workers)
+    for url, result in fetcher.fetch_all(jobs).items():
+        print(f"{result}: {url}")
+
+if __name__ == "__main__":
+    main()
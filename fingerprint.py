@@ -0,0 +1,193 @@
+
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+import urllib.parse
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "fingerprint.json")
+EXCLUDE_DIRS = ["old_pages", "components", "resources"]
+SOURCE_DIRS = ["templates", "pages"]  # их ссылки считаются от корня сайта, как у готовых страниц
+
+# Что получает ?v=<хэш>: общие файлы сайта и всё в resources/
+ASSET_FILES = ["style.css", "main.js", "tailwind-config.js", "accessibility.js"]
+ASSET_DIRS = ["resources"]
+HASH_LEN = 10  # как у бандла build_css: site.<10 hex>.css
+
+ATTR_URL = re.compile(r'''(\b(?:src|href|poster|data-src)\s*=\s*)(["'])([^"'<>]*)\2''', re.IGNORECASE)
+SRCSET = re.compile(r'''(\bsrcset\s*=\s*)(["'])([^"'<>]*)\2''', re.IGNORECASE)
+CSS_URL = re.compile(r'''(url\(\s*)(["']?)([^"'()<>]*)\2(\s*\))''', re.IGNORECASE)
+EXTERNAL = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//|#)', re.IGNORECASE)
+VERSION = re.compile(r'^v=[0-9a-f]*$')
+
+lock = threading.Lock()
+
+# --- ХЭШИ ---
+# Манифест: assets — rel -> {mtime, size, hash}. Хэш пересчитывается, только
+# если у файла сменились mtime или размер.
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp = MANIFEST_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp, MANIFEST_FILE)
+
+def rel(path):
+    return os.path.relpath(path, ROOT_DIR).replace('\\', '/')
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''): h.update(chunk)
+    return h.hexdigest()[:HASH_LEN]
+
+def is_asset(name):
+    return name in ASSET_FILES or any(name.startswith(d + '/') for d in ASSET_DIRS)
+
+def list_assets():
+    found = [os.path.join(ROOT_DIR, n) for n in ASSET_FILES if os.path.isfile(os.path.join(ROOT_DIR, n))]
+    for d in ASSET_DIRS:
+        for root, dirs, files in os.walk(os.path.join(ROOT_DIR, d)):
+            dirs[:] = [x for x in dirs if not x.startswith('.')]
+            found += [os.path.join(root, f) for f in files if not f.startswith('.') and not f.endswith('.part')]
+    return sorted(found)
+
+def update_asset(assets, path):
+    # True, если хэш файла изменился (или файл появился / исчез)
+    name = rel(path)
+    try: st = os.stat(path)
+    except OSError: return assets.pop(name, None) is not None
+    known = assets.get(name)
+    if known and known['mtime'] == st.st_mtime_ns and known['size'] == st.st_size: return False
+    digest = file_hash(path)
+    assets[name] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'hash': digest}
+    return not known or known['hash'] != digest
+
+# --- ССЫЛКИ ---
+
+def list_pages():
+    pages = []
+    for root, dirs, files in os.walk(ROOT_DIR):
+        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                pages.append(os.path.join(root, file))
+    return sorted(pages)
+
+def is_page(path):
+    parts = rel(path).split('/')
+    return path.endswith('.html') and not parts[0].startswith('..') and \
+        not any(p in EXCLUDE_DIRS or p.startswith('.') for p in parts[:-1])
+
+def page_base(path):
+    top = rel(path).split('/')[0]
+    return ROOT_DIR if top in SOURCE_DIRS else os.path.dirname(path)
+
+def versioned(url, base, assets):
+    # URL локального ассета -> тот же URL с ?v=<хэш>; чужие и внешние не трогаем
+    if EXTERNAL.match(url): return url
+    parts = urllib.parse.urlsplit(url)
+    if not parts.path or (parts.query and not VERSION.match(parts.query)): return url
+    target = os.path.normpath(os.path.join(ROOT_DIR if parts.path.startswith('/') else base,
+                                           urllib.parse.unquote(parts.path).lstrip('/')))
+    info = assets.get(rel(target))
+    if not info: return url
+    return urllib.parse.urlunsplit(('', '', parts.path, 'v=' + info['hash'], parts.fragment))
+
+def rewrite_urls(content, fn):
+    # fn(url) -> url для каждой ссылки в src/href/srcset/url(); используется и ref_graph
+    attr = lambda m: m.group(1) + m.group(2) + fn(m.group(3)) + m.group(2)
+    css = lambda m: m.group(1) + m.group(2) + fn(m.group(3)) + m.group(2) + m.group(4)
+
+    def srcset(m):
+        items = []
+        for item in m.group(3).split(','):
+            words = item.split()  # "url 2x"
+            if words: words[0] = fn(words[0])
+            items.append(' '.join(words))
+        return m.group(1) + m.group(2) + ', '.join(items) + m.group(2)
+
+    return CSS_URL.sub(css, SRCSET.sub(srcset, ATTR_URL.sub(attr, content)))
+
+def rewrite_page(content, base, assets):
+    return rewrite_urls(content, lambda url: versioned(url, base, assets))
+
+def update_file(path, fn):
+    # Чтение -> fn(текст) -> атомарная замена; True, если текст изменился.
+    # Несуществующий файл читается как пустой. Сервер подставляет свою версию —
+    # через историю и под блокировкой пути
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+    except FileNotFoundError:
+        content = ''
+    new_content = fn(content)
+    if new_content == content: return False
+    with open(path + '.tmp', 'w', encoding='utf-8', newline='') as f:
+        f.write(new_content)
+    os.replace(path + '.tmp', path)
+    return True
+
+def rewrite_file(path, assets, update=None):
+    return (update or update_file)(path, lambda content: rewrite_page(content, page_base(path), assets))
+
+# --- СБОРКА ---
+
+def build(force=False):
+    # Полный проход: хэши всех ассетов, затем все страницы. Возвращает переписанные страницы
+    with lock:
+        manifest = load_manifest()
+        assets = {} if force else manifest.get('assets', {})
+        live = {rel(p) for p in list_assets()}
+        for name in [n for n in assets if n not in live]: del assets[name]
+        for path in list_assets(): update_asset(assets, path)
+        save_manifest({'assets': assets})
+        return [p for p in list_pages() if rewrite_file(p, assets)]
+
+def on_save(path, update=None):
+    # Инкрементально после правки через CMS. Пока сайт не переведён на
+    # отпечатки (нет манифеста), ничего не делает. update(path, fn) — см. update_file
+    if not os.path.exists(MANIFEST_FILE): return []
+    name = rel(path)
+    with lock:
+        manifest = load_manifest()
+        assets = manifest.get('assets', {})
+        if is_asset(name):
+            if not update_asset(assets, path): return []
+            save_manifest({'assets': assets})
+            # Хэш сменился — переписываем только страницы, где упоминается имя файла
+            needles = {os.path.basename(name), urllib.parse.quote(os.path.basename(name))}
+            changed = []
+            for page in list_pages():
+                with open(page, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                if not any(n in content for n in needles): continue
+                if rewrite_file(page, assets, update): changed.append(page)
+            return changed
+        if is_page(path) and os.path.isfile(path):
+            return [path] if rewrite_file(path, assets, update) else []
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description="Add ?v=<content hash> to asset references in every page")
+    parser.add_argument("--force", action="store_true", help="re-hash every asset")
+    args = parser.parse_args()
+    changed = build(args.force)
+    for path in changed:
+        print(f"Updated {rel(path)}")
+    print(f"{len(load_manifest().get('assets', {}))} assets, {len(changed)} pages updated")
+
+if __name__ == "__main__":
+    main()
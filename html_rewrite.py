@@ -0,0 +1,134 @@
+
+import os
+import re
+import sys
+import difflib
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXCLUDE_DIRS = ["old_pages", "components", "resources", "templates", "pages"]
+INLINE_FLAGS = [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's')]
+
+# --- ПРАВИЛА ---
+# Все правила склеиваются в одну альтернацию, так что страница просматривается
+# один раз, сколько бы правил ни было. При совпадении в одной позиции побеждает
+# правило, стоящее раньше в списке.
+# repl — строка-шаблон или функция уровня модуля (правила уходят в пул процессов).
+# В шаблонах правил только нумерованные группы и без обратных ссылок \1:
+# в общей альтернации номера сдвигаются, а одинаковые имена групп конфликтуют.
+
+class Rule:
+    def __init__(self, name, pattern, repl, flags=0, unless=None, limit=None):
+        self.name = name
+        self.pattern = pattern
+        self.regex = re.compile(pattern, flags)
+        self.flags = flags
+        self.repl = repl
+        self.unless = unless  # подстрока: если она уже есть в странице, правило не применяется
+        self.limit = limit    # сколько замен максимум на страницу
+
+    def applies(self, content):
+        return not (self.unless and self.unless in content)
+
+    def replace(self, m):
+        return self.repl(m) if callable(self.repl) else m.expand(self.repl)
+
+def alternation(words):
+    # Литералы -> одна альтернация; длинные первыми, чтобы не съел общий префикс
+    return '|'.join(re.escape(w) for w in sorted(set(words), key=lambda w: (-len(w), w)))
+
+class Rewriter:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.combined = {}
+
+    def compile(self, active):
+        # Скомпилированная альтернация на каждый набор активных правил
+        key = tuple(active)
+        if key not in self.combined:
+            parts = []
+            for i in active:
+                rule = self.rules[i]
+                # Флаги правила действуют только внутри его ветки
+                flags = ''.join(c for flag, c in INLINE_FLAGS if rule.flags & flag)
+                parts.append(f"(?P<r{i}>(?{flags}:{rule.pattern}))" if flags else f"(?P<r{i}>{rule.pattern})")
+            self.combined[key] = re.compile('|'.join(parts))
+        return self.combined[key]
+
+    def rewrite(self, content):
+        # Возвращает (новый текст, {имя правила: число замен})
+        active = [i for i, rule in enumerate(self.rules) if rule.applies(content)]
+        counts = {}
+        if not active: return content, counts
+        regex = self.compile(active)
+
+        def repl(m):
+            rule = self.rules[int(m.lastgroup[1:])]
+            if rule.limit is not None and counts.get(rule.name, 0) >= rule.limit:
+                return m.group(0)
+            # Группы правила внутри общей альтернации перенумерованы — сопоставляем
+            # его собственный шаблон в той же позиции (только на совпадениях)
+            own = rule.regex.match(content, m.start())
+            new = rule.replace(own)
+            if new != m.group(0):
+                counts[rule.name] = counts.get(rule.name, 0) + 1
+            return new
+
+        return regex.sub(repl, content), counts
+
+def rewrite_file(rewriter, path, dry_run=False):
+    # Выполняется в пуле процессов; пишет только если текст изменился
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    new_content, counts = rewriter.rewrite(content)
+    if new_content == content:
+        return path, {}, None
+    diff = None
+    if dry_run:
+        diff = ''.join(difflib.unified_diff(content.splitlines(True), new_content.splitlines(True), path, path))
+    else:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(new_content)
+        os.replace(path + '.tmp', path)
+    return path, counts, diff
+
+def list_pages(root=ROOT_DIR, exclude=EXCLUDE_DIRS):
+    pages = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in exclude and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                pages.append(os.path.join(dirpath, file))
+    return sorted(pages)
+
+def run(rules, paths, workers=None, dry_run=False):
+    rewriter = Rewriter(rules)
+    job = functools.partial(rewrite_file, rewriter, dry_run=dry_run)
+    if len(paths) < 2 or workers == 1:
+        return [job(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(job, paths, chunksize=4))
+
+def main(rules, description):
+    # Общий CLI для скриптов-правил (replace_images.py, inject_accessibility.py)
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("paths", nargs="*", help="pages to rewrite (default: every page under --root)")
+    parser.add_argument("--root", default=ROOT_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="print a diff instead of writing")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(p) for p in args.paths] or list_pages(os.path.abspath(args.root))
+    total = 0
+    for path, counts, diff in run(rules, paths, args.workers, args.dry_run):
+        if not counts: continue
+        total += 1
+        if diff: sys.stdout.write(diff)
+        summary = ", ".join(f"{name}: {n}" for name, n in counts.items())
+        print(f"{'Would update' if args.dry_run else 'Updated'} {os.path.relpath(path, args.root)} ({summary})")
+    print(f"\n{total} of {len(paths)} pages {'would change' if args.dry_run else 'changed'}.")
+
+if __name__ == "__main__":
+    main([], "Rewrite site pages with a set of rules")
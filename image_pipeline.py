@@ -0,0 +1,150 @@
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+try: from PIL import Image
+except ImportError: Image = None
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESOURCES_DIR = os.path.join(ROOT_DIR, "resources")
+OUTPUT_DIR = os.path.join(RESOURCES_DIR, "responsive")
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+EXCLUDE_DIRS = ["old_pages", "components", "resources"]
+
+SOURCE_EXT = {".jpg", ".jpeg", ".png", ".webp"}
+WIDTHS = [320, 640, 960, 1280]
+WEBP_QUALITY = 80
+SIZES = "(max-width: 768px) 100vw, 50vw"
+
+IMG_TAG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+SRC_ATTR = re.compile(r'(\ssrc=(["\'])(resources/[^"\']+)\2)')
+OLD_ATTRS = re.compile(r'\s(?:srcset|sizes)=(["\']).*?\1', re.DOTALL)
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    tmp = MANIFEST_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_FILE)
+
+def scan_sources(manifest):
+    # Возвращает исходники, которые надо пересобрать; остальные берутся из манифеста
+    current, todo = {}, []
+    for name in sorted(os.listdir(RESOURCES_DIR)):
+        path = os.path.join(RESOURCES_DIR, name)
+        if not os.path.isfile(path) or os.path.splitext(name)[1].lower() not in SOURCE_EXT:
+            continue
+        rel = "resources/" + name
+        st = os.stat(path)
+        old = manifest.get(rel)
+        if old and old['mtime'] == st.st_mtime_ns and old['size'] == st.st_size:
+            current[rel] = old
+            continue
+        digest = file_digest(path)
+        if old and old['hash'] == digest:
+            current[rel] = dict(old, mtime=st.st_mtime_ns, size=st.st_size)
+            continue
+        todo.append((rel, path, digest, st.st_mtime_ns, st.st_size))
+    return current, todo
+
+def build_derivatives(job):
+    # Выполняется в отдельном процессе; имена файлов зависят только от содержимого
+    rel, path, digest, mtime, size = job
+    variants = {}
+    with Image.open(path) as im:
+        width, height = im.size
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "P") else "RGB")
+        for w in WIDTHS:
+            if w >= width: break
+            name = f"{digest[:16]}-{w}.webp"
+            out = os.path.join(OUTPUT_DIR, name)
+            if not os.path.exists(out):
+                resized = im.resize((w, round(height * w / width)), Image.LANCZOS)
+                resized.save(out + '.tmp', 'WEBP', quality=WEBP_QUALITY, method=6)
+                os.replace(out + '.tmp', out)
+            variants[str(w)] = "resources/responsive/" + name
+    return rel, {'hash': digest, 'mtime': mtime, 'size': size, 'width': width, 'height': height, 'variants': variants}
+
+def remove_orphans(manifest):
+    used = {os.path.basename(v) for entry in manifest.values() for v in entry['variants'].values()}
+    for name in os.listdir(OUTPUT_DIR):
+        if name.endswith('.webp') and name not in used:
+            os.remove(os.path.join(OUTPUT_DIR, name))
+
+def srcset_for(entry, src):
+    if not entry or not entry['variants']: return None
+    parts = [f"{path} {w}w" for w, path in sorted(entry['variants'].items(), key=lambda x: int(x[0]))]
+    parts.append(f"{src} {entry['width']}w")
+    return ", ".join(parts)
+
+def rewrite_tag(tag, manifest):
+    m = SRC_ATTR.search(tag)
+    if not m: return tag
+    src = m.group(3)
+    cleaned = OLD_ATTRS.sub('', tag)
+    # src с ?v=<хэш> от fingerprint.py: в манифесте ищем без запроса, в srcset оставляем как есть
+    srcset = srcset_for(manifest.get(src.split('?', 1)[0]), src)
+    if not srcset: return cleaned
+    m = SRC_ATTR.search(cleaned)
+    return cleaned[:m.end()] + f' srcset="{srcset}" sizes="{SIZES}"' + cleaned[m.end():]
+
+def process_file(filepath, manifest):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    new_content = IMG_TAG.sub(lambda m: rewrite_tag(m.group(0), manifest), content)
+
+    if new_content != content:
+        print(f"Updating srcset in {filepath}")
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build responsive WebP derivatives and rewrite <img> tags")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--no-rewrite", action="store_true", help="only build derivatives")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("Pillow is required: pip install Pillow")
+        sys.exit(1)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    manifest, todo = scan_sources(load_manifest())
+    print(f"{len(manifest)} images up to date, {len(todo)} to build")
+    if todo:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for rel, entry in pool.map(build_derivatives, todo):
+                print(f"Built {rel}: {len(entry['variants'])} variants")
+                manifest[rel] = entry
+    save_manifest(manifest)
+    remove_orphans(manifest)
+
+    if args.no_rewrite: return
+    for root, dirs, files in os.walk(ROOT_DIR):
+        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                process_file(os.path.join(root, file), manifest)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,18 @@
-import os
 
-def inject_accessibility():
-    script_tag = '<script src="accessibility.js"></script>'
-    
-    # List all html files
-    files = [f for f in os.listdir('.') if f.endswith('.html')]
-    
-    updated_count = 0
-    for file_path in files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        if 'accessibility.js' in content:
-            print(f"Skipping {file_path}, already injected.")
-            continue
-            
-        # Try to find </body> or </html> or just append at the end
-        if '</body>' in content:
-            new_content = content.replace('</body>', f'    {script_tag}\n</body>')
-        elif '</html>' in content:
-            new_content = content.replace('</html>', f'    {script_tag}\n</html>')
-        else:
-            new_content = content + f'\n{script_tag}'
-            
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        
-        print(f"Updated {file_path}")
-        updated_count += 1
-        
-    print(f"\nDone! Injected accessibility.js into {updated_count} files.")
+import html_rewrite
+from html_rewrite import Rule
+
+SCRIPT_TAG = '<script src="accessibility.js"></script>'
+
+def insert_script(m):
+    # Before </body>, else before </html>, else at the very end
+    if m.group(0):
+        return f'    {SCRIPT_TAG}\n{m.group(0)}'
+    return f'\n{SCRIPT_TAG}'
+
+RULES = [
+    Rule("accessibility-script", r'</body>|</html>|\Z', insert_script, unless='accessibility.js', limit=1),
+]
 
 if __name__ == "__main__":
-    inject_accessibility()
+    html_rewrite.main(RULES, "Add accessibility.js to every page that lacks it")
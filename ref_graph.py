@@ -0,0 +1,228 @@
+
+import os
+import json
+import argparse
+import threading
+import urllib.parse
+
+import site_audit
+import fingerprint
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+GRAPH_FILE = os.path.join(BUILD_DIR, "refs.json")
+GRAPH_VERSION = 1
+
+# --- КЛЮЧИ ---
+# Ссылка хранится по ключу цели, а не по найденному файлу: "coins", "coins.html"
+# и "coins/index.html" дают один ключ, а битые ссылки тоже остаются в графе —
+# когда файл появится (или его переименуют обратно), связь уже известна.
+
+def key(rel):
+    if rel.endswith('/index.html'): rel = rel[:-len('/index.html')]
+    elif rel == 'index.html': rel = ''
+    elif rel.endswith('.html'): rel = rel[:-len('.html')]
+    return rel.strip('/')
+
+def target_key(page, url):
+    # page — rel страницы; None для внешних ссылок и якорей
+    if site_audit.EXTERNAL.match(url): return None
+    path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+    if not path: return None
+    base = fingerprint.page_base(os.path.join(ROOT_DIR, page))
+    target = os.path.normpath(os.path.join(ROOT_DIR if path.startswith('/') else base, path.lstrip('/')))
+    rel = os.path.relpath(target, ROOT_DIR).replace('\\', '/')
+    if rel.startswith('..'): return None
+    return key('' if rel == '.' else rel)
+
+def relocate(url, base, old, new):
+    # URL, указывающий на old (файл или что-то внутри папки old), -> URL на new.
+    # Стиль ссылки сохраняется: абсолютная/относительная, чистый URL без .html, ?v= и #якорь
+    if site_audit.EXTERNAL.match(url): return url
+    parts = urllib.parse.urlsplit(url)
+    raw = urllib.parse.unquote(parts.path)
+    if not raw: return url
+    target = os.path.normpath(os.path.join(ROOT_DIR if raw.startswith('/') else base, raw.lstrip('/')))
+    for suffix in ('', '.html', os.sep + 'index.html'):
+        candidate = target + suffix
+        if candidate == old or candidate.startswith(old + os.sep):
+            moved = new + candidate[len(old):]
+            moved = moved[:len(moved) - len(suffix)]
+            break
+    else:
+        return url
+    if raw.startswith('/'): path = '/' + os.path.relpath(moved, ROOT_DIR)
+    else: path = os.path.relpath(moved, base)
+    path = path.replace('\\', '/') + ('/' if raw.endswith('/') and not path.endswith('/') else '')
+    return urllib.parse.urlunsplit(('', '', urllib.parse.quote(path), parts.query, parts.fragment))
+
+# --- ГРАФ ---
+# На диске только прямые рёбра: страница -> [(url, ключ цели, вид, строка)].
+# Обратный индекс ключ -> {страницы} строится в памяти при загрузке, поэтому
+# «кто ссылается на X» — один поиск в словаре. Страница разбирается одним
+# проходом site_audit.scan_page; другие процессы видят смену файла по mtime.
+
+class RefGraph:
+    def __init__(self, root=ROOT_DIR, graph_file=GRAPH_FILE):
+        self.root = root
+        self.graph_file = graph_file
+        self.pages = {}     # rel -> {'mtime', 'size', 'refs': [[url, key, kind, line]]}
+        self.incoming = {}  # key -> {rel страницы: число ссылок}
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def rel(self, path):
+        return os.path.relpath(path, self.root).replace('\\', '/')
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.graph_file)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def refresh(self):
+        # Вызывается под lock
+        stamp = self.file_stamp()
+        if stamp == self.stamp: return
+        try:
+            with open(self.graph_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.pages = data.get('pages', {}) if data.get('version') == GRAPH_VERSION else {}
+        self.incoming = {}
+        for rel, page in self.pages.items(): self.link(rel, page, 1)
+        self.stamp = stamp
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.graph_file), exist_ok=True)
+        tmp = f"{self.graph_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': GRAPH_VERSION, 'pages': self.pages}, f, separators=(',', ':'))
+        os.replace(tmp, self.graph_file)
+        self.stamp = self.file_stamp()
+
+    def link(self, rel, page, sign):
+        for _, k, _, _ in page['refs']:
+            refs = self.incoming.setdefault(k, {})
+            refs[rel] = refs.get(rel, 0) + sign
+            if refs[rel] <= 0: del refs[rel]
+            if not refs: del self.incoming[k]
+
+    def remove(self, rel):
+        page = self.pages.pop(rel, None)
+        if page: self.link(rel, page, -1)
+
+    def scan(self, path):
+        # 1, если страница разобрана заново
+        if not fingerprint.is_page(path): return 0
+        try: st = os.stat(path)
+        except OSError: return 0
+        rel = self.rel(path)
+        page = self.pages.get(rel)
+        if page and page['mtime'] == st.st_mtime_ns and page['size'] == st.st_size: return 0
+        try: _, _, facts = site_audit.scan_page(path)
+        except OSError: return 0
+        refs = [(i['src'], 'image', i['line']) for i in facts['images']]
+        refs += [(a['url'], 'asset', a['line']) for a in facts['assets']]
+        refs += [(l['href'], 'link', l['line']) for l in facts['links']]
+        self.remove(rel)
+        self.pages[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size,
+                           'refs': [[url, k, kind, line] for url, kind, line in refs if (k := target_key(rel, url)) is not None]}
+        self.link(rel, self.pages[rel], 1)
+        return 1
+
+    def update(self, *paths):
+        # Инкрементально после мутаций через CMS: файлы и папки из notify_change
+        with self.lock:
+            self.refresh()
+            changed = 0
+            for path in paths:
+                rel = self.rel(path)
+                for page in [p for p in self.pages if p == rel or p.startswith(rel + '/')]:
+                    if not os.path.isfile(os.path.join(self.root, page)):
+                        self.remove(page)
+                        changed += 1
+                if os.path.isdir(path): targets = [os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs]
+                else: targets = [path]
+                changed += sum(self.scan(p) for p in targets)
+            if changed: self.save()
+            return changed
+
+    def sync(self):
+        # Полная сверка с диском (при старте)
+        with self.lock:
+            self.refresh()
+            pages = fingerprint.list_pages()
+            live = {self.rel(p) for p in pages}
+            stale = [rel for rel in self.pages if rel not in live]
+            for rel in stale: self.remove(rel)
+            changed = len(stale) + sum(self.scan(p) for p in pages)
+            if changed or self.stamp is None: self.save()
+            return changed
+
+    # --- ЗАПРОСЫ ---
+
+    def referrers(self, path):
+        # Страницы, ссылающиеся на path; для папки — на что угодно внутри неё
+        k = key(self.rel(path))
+        with self.lock:
+            self.refresh()
+            if not os.path.isdir(path):
+                return sorted(self.incoming.get(k, {}))
+            found = set()
+            for target, refs in self.incoming.items():
+                if not k or target == k or target.startswith(k + '/'): found.update(refs)
+            return sorted(found)
+
+    def references(self, path):
+        # Исходящие ссылки страницы: [{url, target, kind, line, exists}]
+        with self.lock:
+            self.refresh()
+            page = self.pages.get(self.rel(path), {'refs': []})
+            refs = list(page['refs'])
+        site, rel = site_audit.Site(self.root), self.rel(path)
+        return [{'url': url, 'target': k, 'kind': kind, 'line': line, 'exists': site.resolve(rel, url) is not None}
+                for url, k, kind, line in refs]
+
+    def rewrite_referrers(self, old, new, pages, update=None):
+        # После переименования old -> new: одним проходом правит ссылки во всех
+        # страницах-референтах. pages — результат referrers(old) до переименования;
+        # update(path, fn) — как в fingerprint.update_file. Возвращает пути изменённых страниц
+        changed = []
+        for rel in pages:
+            path = os.path.join(self.root, rel)
+            if path == old or path.startswith(old + os.sep): path = new + path[len(old):]
+            base = fingerprint.page_base(path)
+            fn = lambda content: fingerprint.rewrite_urls(content, lambda url: relocate(url, base, old, new))
+            try:
+                if (update or fingerprint.update_file)(path, fn): changed.append(path)
+            except OSError:
+                continue
+        return changed
+
+graph = RefGraph()
+
+def on_change(*paths):
+    # Хук для server.notify_change
+    return graph.update(*paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Show which pages reference a file, or what a page references")
+    parser.add_argument("path", nargs="?", help="file or folder, relative to the site root")
+    parser.add_argument("--outgoing", action="store_true", help="list what the page references instead")
+    args = parser.parse_args()
+
+    changed = graph.sync()
+    print(f"{len(graph.pages)} pages in the graph, {changed} rescanned")
+    if not args.path: return
+    path = os.path.join(ROOT_DIR, args.path)
+    if args.outgoing:
+        for r in graph.references(path):
+            print(f"{r['line']:>5}  {r['kind']:<6} {r['url']}{'' if r['exists'] else '  (missing)'}")
+    else:
+        for rel in graph.referrers(path): print(rel)
+
+if __name__ == "__main__":
+    main()
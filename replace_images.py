@@ -1,9 +1,6 @@
 
-import os
-import re
-
-ROOT_DIR = r"d:\sites\coin"
-EXCLUDE_DIRS = ["old_pages", "components", "resources"]
+import html_rewrite
+from html_rewrite import Rule
 
 # Map old external URL substrings to new local files
 REPLACEMENTS = {
@@ -17,38 +14,15 @@ REPLACEMENTS = {
     "coin-02-450x350.jpg": "resources/coins_pile.jpg" # Fallback
 }
 
-def process_file(filepath):
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    original_content = content
-    
-    # Regex to find src="...fairfaxcoin.../filename"
-    # match group 1 is the whole url, match group 2 is the filename part if we want
-    
-    for old_file_part, new_local_path in REPLACEMENTS.items():
-        # Pattern: src="[^"]*old_file_part"
-        # We need to be careful not to replace something that doesn't match the old domain if it exists (though unlikely)
-        # But the USER said "replace all pictures that are pulled from the old site"
-        
-        # Regex that matches src="http...fairfax.../filename"
-        pattern = r'src=["\']https?://fairfaxcoinandbullionexchange\.com[^"\']*/' + re.escape(old_file_part) + r'["\']'
-        
-        if re.search(pattern, content):
-            # Replace with src="new_local_path"
-            content = re.sub(pattern, f'src="{new_local_path}"', content)
-
-    if content != original_content:
-        print(f"Updating images in {filepath}")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+def local_src(m):
+    return f'src="{REPLACEMENTS[m.group(1)]}"'
 
-def main():
-    for root, dirs, files in os.walk(ROOT_DIR):
-        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS]
-        for file in files:
-            if file.endswith(".html"):
-                process_file(os.path.join(root, file))
+# One rule for all files: src="http...fairfax.../<one of the names>"
+RULES = [
+    Rule("old-images",
+         r'src=["\']https?://fairfaxcoinandbullionexchange\.com[^"\']*/(' + html_rewrite.alternation(REPLACEMENTS) + r')["\']',
+         local_src),
+]
 
 if __name__ == "__main__":
-    main()
+    html_rewrite.main(RULES, "Replace images pulled from the old site with local copies")
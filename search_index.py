@@ -0,0 +1,397 @@
+
+import os
+import re
+import sys
+import json
+import math
+import html
+import hashlib
+import argparse
+import threading
+from html.parser import HTMLParser
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+INDEX_FILE = os.path.join(BUILD_DIR, "search.json")
+TEXT_DIR = os.path.join(BUILD_DIR, "search")  # текст и позиции слов, по файлу на страницу
+INDEX_VERSION = 2
+SAVE_DELAY = 1  # секунд: правки через CMS копятся и пишутся на диск одной записью
+EXCLUDE_DIRS = ["old_pages", "components", "resources", "templates", "pages"]
+
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'head'}
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'section', 'article', 'header', 'footer', 'nav', 'main', 'aside', 'ul', 'ol', 'table', 'form'}
+WORD = re.compile(r'\w+')
+PHRASE = re.compile(r'"([^"]*)"')
+
+# Ранжирование BM25; совпадение в <title> весит как TITLE_BOOST вхождений в тексте
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_BOOST = 3
+SNIPPET_CHARS = 160
+SNIPPET_WORDS = 20
+MAX_RESULTS = 50
+
+# --- ИЗВЛЕЧЕНИЕ ТЕКСТА ---
+# Индексируется только видимый текст: без скриптов, стилей и разметки.
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = []
+        self.skip = 0
+        self.in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title': self.in_title = True
+        elif tag in SKIP_TAGS: self.skip += 1
+        elif tag in BLOCK_TAGS: self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'title': self.in_title = False
+        elif tag in SKIP_TAGS: self.skip = max(0, self.skip - 1)
+        elif tag in BLOCK_TAGS: self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS: self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self.in_title: self.title.append(data)
+        elif not self.skip: self.parts.append(data)
+
+def extract(path):
+    # -> (title, text): пробелы схлопнуты, переносы строк остаются между блоками
+    parser = TextExtractor()
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        parser.feed(f.read())
+    parser.close()
+    text = '\n'.join(' '.join(line.split()) for line in ''.join(parser.parts).split('\n'))
+    return ' '.join(''.join(parser.title).split()), re.sub(r'\n+', '\n', text).strip()
+
+def tokenize(text):
+    return [w.lower() for w in WORD.findall(text)]
+
+def positions(text):
+    # слово -> [номера его вхождений в тексте]
+    found = {}
+    for pos, word in enumerate(tokenize(text)):
+        found.setdefault(word, []).append(pos)
+    return found
+
+def list_pages(root=ROOT_DIR):
+    pages = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                pages.append(os.path.join(dirpath, file))
+    return sorted(pages)
+
+# --- ИНДЕКС ---
+# postings: слово -> {страница: сколько раз встречается}. Запрос пересекает
+# списки страниц начиная с самого короткого, так что время поиска зависит от
+# редкости слов, а не от числа страниц. Текст страницы и позиции слов (для фраз
+# в кавычках и сниппетов) лежат отдельно, по файлу на страницу в TEXT_DIR, и
+# читаются только для страниц-кандидатов. Правка страницы переписывает её
+# файл и небольшой общий JSON — не текст всего сайта. Запись на диск идёт в
+# фоне через SAVE_DELAY после правки; другие процессы замечают смену общего
+# файла по mtime и перечитывают его.
+
+class SearchIndex:
+    def __init__(self, root=ROOT_DIR, index_file=INDEX_FILE, text_dir=TEXT_DIR):
+        self.root = root
+        self.index_file = index_file
+        self.text_dir = text_dir
+        self.docs = {}      # rel -> {'mtime', 'size', 'title', 'length'}
+        self.postings = {}  # word -> {rel: число вхождений}
+        self.details = {}   # rel -> {'mtime', 'size', 'text', 'positions': {word: [позиции]}}
+        self.dirty = set()  # страницы, изменённые после последней записи на диск
+        self.total_length = 0
+        self.stamp = None   # (mtime_ns, size) загруженного файла
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def rel(self, path):
+        return os.path.relpath(path, self.root).replace('\\', '/')
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.index_file)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def text_path(self, rel):
+        return os.path.join(self.text_dir, hashlib.sha1(rel.encode('utf-8')).hexdigest()[:16] + '.json')
+
+    def refresh(self):
+        # Перечитать файл, если его записал другой процесс (вызывается под lock)
+        stamp = self.file_stamp()
+        if stamp == self.stamp: return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') != INDEX_VERSION: data = {}
+        self.docs = data.get('docs', {})
+        self.postings = data.get('postings', {})
+        self.total_length = sum(d['length'] for d in self.docs.values())
+        self.stamp = stamp
+        # Свои ещё не записанные правки накладываем поверх чужого файла
+        if self.dirty: self.apply([os.path.join(self.root, rel) for rel in self.dirty])
+
+    def save(self):
+        # Вызывается под lock
+        os.makedirs(self.text_dir, exist_ok=True)
+        for rel in self.dirty:
+            path = self.text_path(rel)
+            detail = self.details.get(rel)
+            if rel not in self.docs or detail is None:
+                if os.path.exists(path): os.remove(path)
+                continue
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(detail, f, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+        self.dirty.clear()
+        tmp = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'docs': self.docs, 'postings': self.postings}, f, separators=(',', ':'))
+        os.replace(tmp, self.index_file)
+        self.stamp = self.file_stamp()
+
+    def schedule_save(self):
+        # Вызывается под lock: несколько правок подряд дают одну запись, и не в потоке запроса
+        if self.timer is not None: return
+        self.timer = threading.Timer(SAVE_DELAY, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if self.dirty: self.save()
+
+    def detail(self, rel):
+        # Текст и позиции страницы: из памяти, иначе из её файла (вызывается под lock)
+        doc = self.docs[rel]
+        detail = self.details.get(rel)
+        if detail and (detail['mtime'], detail['size']) == (doc['mtime'], doc['size']): return detail
+        try:
+            with open(self.text_path(rel), 'r', encoding='utf-8') as f:
+                detail = json.load(f)
+        except (OSError, ValueError):
+            detail = None
+        if not detail or (detail['mtime'], detail['size']) != (doc['mtime'], doc['size']):
+            # Файла нет или он от другой версии страницы — разбираем её заново
+            try: text = extract(os.path.join(self.root, rel))[1]
+            except OSError: text = ''
+            detail = {'mtime': doc['mtime'], 'size': doc['size'], 'text': text, 'positions': positions(text)}
+        self.details[rel] = detail
+        return detail
+
+    def remove(self, rel):
+        doc = self.docs.pop(rel, None)
+        if not doc: return
+        self.total_length -= doc['length']
+        self.details.pop(rel, None)
+        self.dirty.add(rel)
+        for word in [w for w, docs in self.postings.items() if rel in docs]:
+            docs = self.postings[word]
+            del docs[rel]
+            if not docs: del self.postings[word]
+
+    def add(self, path, st):
+        rel = self.rel(path)
+        self.remove(rel)
+        title, text = extract(path)
+        found = positions(text)
+        for word, pos in found.items():
+            self.postings.setdefault(word, {})[rel] = len(pos)
+        # Слова только из заголовка тоже находятся — с нулём вхождений в тексте
+        for word in set(tokenize(title)):
+            self.postings.setdefault(word, {}).setdefault(rel, 0)
+        length = sum(len(pos) for pos in found.values())
+        self.docs[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'title': title, 'length': length}
+        self.details[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'text': text, 'positions': found}
+        self.total_length += length
+
+    def is_page(self, path):
+        if not path.endswith('.html') or not path.startswith(os.path.join(self.root, '')): return False
+        parts = self.rel(path).split('/')[:-1]
+        return not any(p in EXCLUDE_DIRS or p.startswith('.') for p in parts)
+
+    def relevant(self, path):
+        # Без lock: существующий файл не-страница (картинка, CSS) индекс не меняет;
+        # папки и исчезнувшие пути могут содержать страницы
+        if path.endswith('.html'): return self.is_page(path)
+        return not os.path.isfile(path)
+
+    def apply(self, paths):
+        # Вызывается под lock; возвращает число переиндексированных и удалённых страниц
+        changed = 0
+        for path in paths:
+            rel_path = self.rel(path)
+            for rel in [r for r in self.docs if r == rel_path or r.startswith(rel_path + '/')]:
+                if not os.path.isfile(os.path.join(self.root, rel)):
+                    self.remove(rel)
+                    changed += 1
+            targets = list_pages(path) if os.path.isdir(path) else [path]
+            for page in targets:
+                changed += self.index_page(page)
+        return changed
+
+    def update(self, *paths):
+        # Инкрементально: только перечисленные файлы или папки (после мутаций через CMS).
+        # Возвращает число переиндексированных и удалённых страниц
+        paths = [p for p in paths if self.relevant(p)]
+        if not paths: return 0
+        with self.lock:
+            self.refresh()
+            changed = self.apply(paths)
+            if changed: self.schedule_save()
+            return changed
+
+    def index_page(self, path):
+        if not self.is_page(path): return 0
+        try: st = os.stat(path)
+        except OSError: return 0
+        doc = self.docs.get(self.rel(path))
+        if doc and doc['mtime'] == st.st_mtime_ns and doc['size'] == st.st_size: return 0
+        try: self.add(path, st)
+        except (OSError, UnicodeDecodeError): return 0
+        self.dirty.add(self.rel(path))
+        return 1
+
+    def sync(self):
+        # Полная сверка с диском (при старте): изменённое мимо CMS тоже подхватывается
+        with self.lock:
+            self.refresh()
+            pages = list_pages(self.root)
+            live = {self.rel(p) for p in pages}
+            stale = [rel for rel in self.docs if rel not in live]
+            for rel in stale: self.remove(rel)
+            changed = len(stale) + sum(self.index_page(p) for p in pages)
+            if changed or self.dirty or self.stamp is None: self.save()
+            return changed
+
+    # --- ПОИСК ---
+
+    def parse_query(self, query):
+        # -> (слова, фразы); фраза — список слов в кавычках
+        phrases = [tokenize(p) for p in PHRASE.findall(query)]
+        words = tokenize(PHRASE.sub(' ', query)) + [w for p in phrases for w in p]
+        return list(dict.fromkeys(words)), [p for p in phrases if len(p) > 1]
+
+    def phrase_start(self, rel, phrase):
+        # Первая позиция, с которой фраза идёт подряд, или None
+        found = self.detail(rel)['positions']
+        first = found.get(phrase[0], [])
+        rest = [set(found.get(w, [])) for w in phrase[1:]]
+        for pos in first:
+            if all(pos + i + 1 in s for i, s in enumerate(rest)): return pos
+        return None
+
+    def best_window(self, rel, words):
+        # Начало окна в SNIPPET_WORDS слов, где встречается больше всего разных слов запроса
+        found = self.detail(rel)['positions']
+        hits = sorted((pos, w) for w in words for pos in found.get(w, []))
+        best, best_count, lo, counts = None, 0, 0, {}
+        for pos, w in hits:
+            counts[w] = counts.get(w, 0) + 1
+            while hits[lo][0] < pos - SNIPPET_WORDS:
+                old = hits[lo][1]
+                counts[old] -= 1
+                if not counts[old]: del counts[old]
+                lo += 1
+            if len(counts) > best_count: best, best_count = hits[lo][0], len(counts)
+        return best
+
+    def search(self, query, limit=20, offset=0):
+        with self.lock:
+            self.refresh()
+            words, phrases = self.parse_query(query)
+            if not words or any(w not in self.postings for w in words):
+                return {'query': query, 'total': 0, 'results': []}
+            # Пересечение от самого редкого слова
+            lists = sorted((self.postings[w] for w in words), key=len)
+            candidates = set(lists[0])
+            for docs in lists[1:]:
+                candidates &= docs.keys()
+                if not candidates: break
+            starts = {}
+            for rel in candidates:
+                found = [self.phrase_start(rel, p) for p in phrases]
+                if None not in found: starts[rel] = min(found, default=None)
+            n = len(self.docs)
+            avg = self.total_length / n if n else 0
+            scored = []
+            for rel, start in starts.items():
+                doc = self.docs[rel]
+                title = set(tokenize(doc['title']))
+                score = 0.0
+                for w in words:
+                    df = len(self.postings[w])
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    tf = self.postings[w][rel] + (TITLE_BOOST if w in title else 0)
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc['length'] / avg) if avg else BM25_K1
+                    score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                scored.append((score, rel, start))
+            scored.sort(key=lambda x: (-x[0], x[1]))
+            results = []
+            for score, rel, start in scored[offset:offset + min(limit, MAX_RESULTS)]:
+                doc = self.docs[rel]
+                if start is None: start = self.best_window(rel, words)
+                results.append({'file': rel, 'title': doc['title'], 'score': round(score, 4),
+                                'snippet': snippet(self.detail(rel)['text'], start, set(words))})
+            return {'query': query, 'total': len(scored), 'results': results}
+
+def snippet(text, start, words):
+    # Окно текста вокруг слова номер start; найденные слова — в <mark>, остальное экранировано
+    center = 0
+    if start is not None:
+        for i, m in enumerate(WORD.finditer(text)):
+            if i == start:
+                center = m.start()
+                break
+    # Границы окна сдвигаем к пробелам, чтобы не резать слова
+    lo = max(0, center - SNIPPET_CHARS // 3)
+    if lo: lo = text.find(' ', lo, center) + 1 or lo
+    hi = min(len(text), lo + SNIPPET_CHARS)
+    if hi < len(text): hi = max(text.rfind(' ', center, hi), center + 1) if center < hi else hi
+    out, last = [], lo
+    for m in WORD.finditer(text, lo, hi):
+        if m.group(0).lower() in words:
+            out.append(html.escape(text[last:m.start()]))
+            out.append('<mark>' + html.escape(m.group(0)) + '</mark>')
+            last = m.end()
+    out.append(html.escape(text[last:hi]))
+    body = ''.join(out).replace('\n', ' ')
+    return ('…' if lo else '') + body + ('…' if hi < len(text) else '')
+
+index = SearchIndex()
+
+def on_change(*paths):
+    # Хук для server.notify_change: сохранённые, удалённые и переименованные страницы
+    return index.update(*paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over the site's pages")
+    parser.add_argument("query", nargs="?", help='words to find; use "quotes" for a phrase')
+    parser.add_argument("--rebuild", action="store_true", help="drop the index and re-read every page")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.rebuild and os.path.exists(INDEX_FILE): os.remove(INDEX_FILE)
+    changed = index.sync()
+    print(f"{len(index.docs)} pages indexed, {changed} updated", file=sys.stderr)
+    if not args.query: return
+    found = index.search(args.query, args.limit)
+    for r in found['results']:
+        text = html.unescape(re.sub(r'</?mark>', '*', r['snippet']))
+        print(f"{r['score']:>8}  {r['file']}  {r['title']}\n          {text}")
+    print(f"{found['total']} pages match")
+
+if __name__ == "__main__":
+    main()
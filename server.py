@@ -1,4 +1,5 @@
 import http.server
+import http.client
 import socketserver
 import os
 import json
@@ -11,9 +12,40 @@ import hashlib
 import hmac
 import time
 import uuid
+import io
+import asyncio
+import socket
+import traceback
+import secrets
+import sqlite3
 import base64
+import threading
+import queue
+import signal
+import argparse
+import build_css
+import build_pages
+import search_index
+import fingerprint
+import ref_graph
+import email.utils
+import tempfile
+import gzip
+import zlib
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from http import cookies
 
+try: import brotli
+except ImportError: brotli = None
+
+try: from PIL import Image, ImageOps, features
+except ImportError: Image = None
+
+try: import fcntl
+except ImportError: fcntl = None  # Windows: --processes нет, журнал пишет один процесс
+
 # --- КОНФИГУРАЦИЯ ---
 PORT = 8000
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,15 +54,223 @@ CONFIG_FILE = os.path.join(ROOT_DIR, 'nanocms.json')
 # Ограничения безопасности
 ALLOWED_EXT = {'.html', '.htm', '.css', '.js', '.txt', '.xml', '.php', '.md', '.json', '.jpg', '.png', '.svg', '.gif', '.jpeg', '.webp'}
 IMAGE_EXT = {'.jpg', '.png', '.svg', '.gif', '.jpeg', '.webp'}
-EXCLUDE_FILES = {'server.py', 'nanocms.php', 'nanocms.json', '.htaccess', '.git', '.DS_Store', '__pycache__'}
+EXCLUDE_FILES = {'server.py', 'nanocms.php', 'nanocms.json', '.htaccess', '.git', '.build', '.DS_Store', '__pycache__'}
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_TIME = 300  # 5 минут блокировки
+PBKDF2_TARGET_MS = 100             # сколько должна занимать одна проверка пароля
+PBKDF2_MIN_ITERATIONS = 100000     # ниже не опускаемся даже на быстрой машине
+PBKDF2_MAX_ITERATIONS = 5000000
+PBKDF2_REHASH_FACTOR = 2           # перехэшируем, если итерации хэша разошлись с подобранными больше чем вдвое
+HASH_WORKERS = 2                   # одновременных PBKDF2 (хэширование отпускает GIL)
+HASH_QUEUE = 8                     # ожидающих сверх этого — сразу 503
+THROTTLE_MAX_KEYS = 10000     # сколько IP помнит ограничитель попыток входа
+STATE_DB = None               # общий SQLite-файл сессий и блокировок (--state-db)
+SESSION_TTL = 12 * 3600       # время жизни сессии админки
+SESSION_SWEEP_INTERVAL = 60   # как часто фоновый поток вычищает истёкшие сессии
+SESSION_CACHE_SIZE = 256      # проверенные подписи cookie (LRU)
+
+# Параметры сервера
+WORKERS = 16            # число рабочих потоков
+BACKLOG = 128           # очередь listen() в ядре
+QUEUE_SIZE = 256        # соединения, ожидающие свободного потока
+KEEPALIVE_TIMEOUT = 15  # секунд простоя keep-alive соединения
+SHUTDOWN_TIMEOUT = 10   # сколько ждать потоки при остановке
+RENDER_TEMPLATES = False  # рендерить страницы из pages/ при запросе (--render-templates)
+PROCESSES = 1           # >1 — мастер и столько процессов-воркеров (--processes)
+
+# Кэш статики
+CACHE_MAX_BYTES = 64 * 1024 * 1024   # общий объём тел в памяти
+CACHE_MAX_ENTRY = 1024 * 1024        # файлы крупнее отдаются с диска
+CACHE_CONTROL_HTML = 'no-cache'      # страницы правятся через CMS — всегда ревалидация
+CACHE_CONTROL_ASSETS = 'public, max-age=86400'
+CACHE_CONTROL_IMMUTABLE = 'public, max-age=31536000, immutable'  # ?v=<хэш> совпадает с содержимым
+CACHE_RECHECK = 1                    # --async: столько секунд запись отдаётся из цикла событий без stat
+
+# Таблица маршрутов публичных URL
+ROUTE_REFRESH = 2          # секунд между сверками mtime папок (правки мимо CMS)
+ROUTE_CACHE_SIZE = 10000   # сколько непривычных написаний URL и 404 помнить
+
+# Загрузка файлов
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # на один запрос /api/upload
+UPLOAD_CHUNK = 64 * 1024
+
+# Метрики и журнал запросов
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICS_MAX_PATHS = 500   # сколько разных URL считать поштучно, остальные — в '(other)'
+ACCESS_LOG = None         # JSON-журнал запросов (--access-log)
+ACCESS_LOG_QUEUE = 10000  # строки сверх этого отбрасываются, а не тормозят обработчик
+
+# История версий (.build/history)
+HISTORY_DIR = os.path.join(ROOT_DIR, '.build', 'history')
+HISTORY_MAX_FILE = 10 * 1024 * 1024  # файлы крупнее в историю не попадают
+HISTORY_MAX_VERSIONS = 50            # сколько последних версий файла переживает сжатие журнала
+HISTORY_COMPACT_SIZE = 1024 * 1024   # журнал больше этого сжимается, если в нём больше половины лишнего
+HISTORY_OBJECT_GRACE = 60            # объекты моложе этого при сжатии не удаляются (запись ещё идёт)
+
+# Миниатюры медиатеки (.build/thumbs, нужен Pillow)
+THUMB_DIR = os.path.join(ROOT_DIR, '.build', 'thumbs')
+THUMB_SIZES = (120, 240, 480)  # запрошенный размер округляется вверх до одного из этих
+THUMB_QUALITY = 80
+THUMB_WORKERS = 2              # одновременных генераций
+THUMB_WAIT = 5                 # сколько запрос ждёт генерацию, потом отдаём оригинал
+THUMB_CACHE_CONTROL = 'private, max-age=31536000, immutable'  # для URL с ?v=<хэш оригинала>
+
+# Сжатие текстовых ответов
+COMPRESS_EXT = {'.html', '.htm', '.css', '.js', '.svg', '.json', '.xml', '.txt', '.md'}
+COMPRESS_MIN_SIZE = 1024
+
+# --- ОГРАНИЧЕНИЕ ПОПЫТОК ВХОДА ---
+# Token bucket на IP: MAX_LOGIN_ATTEMPTS попыток подряд, дальше по одной
+# каждые LOCKOUT_TIME / MAX_LOGIN_ATTEMPTS секунд. Полная корзина ничем не
+# отличается от отсутствующей, поэтому такие записи удаляются (TTL = LOCKOUT_TIME).
+
+THROTTLE_RATE = MAX_LOGIN_ATTEMPTS / LOCKOUT_TIME  # токенов в секунду
+
+def refill(tokens, updated, now):
+    return min(MAX_LOGIN_ATTEMPTS, tokens + (now - updated) * THROTTLE_RATE)
+
+class MemoryThrottle:
+    # В памяти процесса: LRU с ограничением по числу IP
+    def __init__(self, max_keys=THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # ip -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def allowed(self, ip):
+        with self.lock:
+            b = self.buckets.get(ip)
+            return b is None or refill(b[0], b[1], time.time()) >= 1
+
+    def hit(self, ip):
+        now = time.time()
+        with self.lock:
+            b = self.buckets.pop(ip, None)
+            tokens = refill(b[0], b[1], now) if b else MAX_LOGIN_ATTEMPTS
+            ok = tokens >= 1
+            self.buckets[ip] = (tokens - 1 if ok else tokens, now)
+            while len(self.buckets) > self.max_keys: self.buckets.popitem(last=False)
+            return ok
+
+    def reset(self, ip):
+        with self.lock: self.buckets.pop(ip, None)
+
+    def sweep(self):
+        cutoff = time.time() - LOCKOUT_TIME
+        with self.lock:
+            # Записи упорядочены по последнему обращению
+            while self.buckets and next(iter(self.buckets.values()))[1] < cutoff:
+                self.buckets.popitem(last=False)
+
+class SqliteStore:
+    # Общий SQLite-файл (--state-db): состояние видят все процессы на одном порту
+    # и оно переживает перезапуск. Соединение — своё у каждого потока.
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        db = self.connect()
+        for statement in self.SCHEMA: db.execute(statement)
+
+    def connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+class SqliteThrottle(SqliteStore):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS login_throttle (ip TEXT PRIMARY KEY, tokens REAL, updated REAL)",
+              "CREATE INDEX IF NOT EXISTS login_throttle_updated ON login_throttle (updated)")
+
+    def __init__(self, path, max_keys=THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        super().__init__(path)
+
+    def allowed(self, ip):
+        row = self.connect().execute("SELECT tokens, updated FROM login_throttle WHERE ip = ?", (ip,)).fetchone()
+        return row is None or refill(row[0], row[1], time.time()) >= 1
+
+    def hit(self, ip):
+        db = self.connect()
+        now = time.time()
+        # BEGIN IMMEDIATE: проверка и списание атомарны и между процессами
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT tokens, updated FROM login_throttle WHERE ip = ?", (ip,)).fetchone()
+            tokens = refill(row[0], row[1], now) if row else MAX_LOGIN_ATTEMPTS
+            ok = tokens >= 1
+            db.execute("INSERT OR REPLACE INTO login_throttle VALUES (?, ?, ?)", (ip, tokens - 1 if ok else tokens, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ok
+
+    def reset(self, ip):
+        self.connect().execute("DELETE FROM login_throttle WHERE ip = ?", (ip,))
+
+    def sweep(self):
+        db = self.connect()
+        db.execute("DELETE FROM login_throttle WHERE updated < ?", (time.time() - LOCKOUT_TIME,))
+        db.execute("DELETE FROM login_throttle WHERE ip IN (SELECT ip FROM login_throttle ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                   (self.max_keys,))
+
+# --- ХРАНИЛИЩЕ СЕССИЙ ---
+class MemorySessions:
+    def __init__(self):
+        self.items = {}  # session id -> время истечения
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock: return self.items.get(sid)
+
+    def put(self, sid, expires):
+        with self.lock: self.items[sid] = expires
+
+    def delete(self, sid):
+        with self.lock: self.items.pop(sid, None)
+
+    def keep_only(self, sid):
+        with self.lock: self.items = {k: v for k, v in self.items.items() if k == sid}
+
+    def sweep(self, now):
+        with self.lock:
+            for sid in [sid for sid, exp in self.items.items() if exp < now]: del self.items[sid]
+
+class SqliteSessions(SqliteStore):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, expires REAL)",)
+
+    def get(self, sid):
+        row = self.connect().execute("SELECT expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, sid, expires):
+        self.connect().execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (sid, expires))
+
+    def delete(self, sid):
+        self.connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def keep_only(self, sid):
+        self.connect().execute("DELETE FROM sessions WHERE sid IS NOT ?", (sid,))
+
+    def sweep(self, now):
+        self.connect().execute("DELETE FROM sessions WHERE expires < ?", (now,))
 
 # --- КЛАСС БЕЗОПАСНОСТИ ---
 class SecurityManager:
     def __init__(self):
+        self.lock = threading.Lock()
+        self.iterations = PBKDF2_MIN_ITERATIONS
+        self.hash_pool = ThreadPoolExecutor(HASH_WORKERS, thread_name_prefix='cms-hash')
+        self.hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+        self.config_mtime = None
         self.config = self.load_config()
-        self.login_attempts = {} # ip -> [timestamp, count]
+        self.key = bytes.fromhex(self.config['secret_key'])
+        self.throttle = MemoryThrottle()
+        self.sessions = MemorySessions()
+        self.verified = OrderedDict()  # подписанное значение cookie -> session id
 
     def load_config(self):
         default_config = {
@@ -41,99 +281,1269 @@ class SecurityManager:
             self.save_config(default_config)
             return default_config
         try:
+            self.config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
             with open(CONFIG_FILE, 'r') as f:
                 return json.load(f)
         except:
             return default_config
 
     def save_config(self, config):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
-        self.config = config
-
-    def hash_password(self, password):
+        with self.lock:
+            # Через временный файл: другие процессы не должны прочитать его наполовину
+            with open(CONFIG_FILE + '.tmp', 'w') as f:
+                json.dump(config, f, indent=4)
+            os.replace(CONFIG_FILE + '.tmp', CONFIG_FILE)
+            self.config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+            self.config = config
+            self.key = bytes.fromhex(config['secret_key'])
+
+    def refresh_config(self):
+        # Конфиг мог поменять другой процесс (--processes): перечитываем по mtime
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime_ns
+            if mtime == self.config_mtime: return
+            with open(CONFIG_FILE, 'r') as f: config = json.load(f)
+        except (OSError, ValueError): return
+        with self.lock:
+            if config.get('secret_key') != self.config.get('secret_key'): self.verified.clear()
+            self.config_mtime = mtime
+            self.config = config
+            self.key = bytes.fromhex(config['secret_key'])
+
+    # Формат хэша: pbkdf2_sha256$итерации$соль$хэш; старый "соль:хэш" — 100000 итераций.
+    # Число итераций хранится в самом хэше, поэтому его можно поднимать без смены пароля.
+
+    def hash_password(self, password, iterations=None):
+        iterations = iterations or self.iterations
         salt = os.urandom(16)
-        pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-        return salt.hex() + ':' + pwd_hash.hex()
+        pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+        return f"pbkdf2_sha256${iterations}${salt.hex()}${pwd_hash.hex()}"
+
+    def parse_hash(self, stored_password):
+        if stored_password.startswith('pbkdf2_sha256$'):
+            _, iterations, salt_hex, hash_hex = stored_password.split('$')
+            return int(iterations), salt_hex, hash_hex
+        salt_hex, hash_hex = stored_password.split(':')
+        return 100000, salt_hex, hash_hex
 
     def verify_password(self, stored_password, provided_password):
         try:
-            salt_hex, hash_hex = stored_password.split(':')
+            iterations, salt_hex, hash_hex = self.parse_hash(stored_password)
             salt = bytes.fromhex(salt_hex)
-            pwd_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode(), salt, 100000)
+            pwd_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode(), salt, iterations)
             return hmac.compare_digest(pwd_hash.hex(), hash_hex)
         except:
             return False
 
+    def needs_rehash(self, stored_password):
+        # calibrate() от запуска к запуску даёт немного разные числа — мелкий разброс
+        # не повод переписывать nanocms.json при каждом входе
+        if not stored_password.startswith('pbkdf2_sha256$'): return True
+        try: iterations = self.parse_hash(stored_password)[0]
+        except ValueError: return False
+        return not self.iterations / PBKDF2_REHASH_FACTOR <= iterations <= self.iterations * PBKDF2_REHASH_FACTOR
+
+    def calibrate(self, target_ms=PBKDF2_TARGET_MS):
+        # Подбираем итерации под целевое время на этой машине (при старте сервера)
+        probe = 20000
+        start = time.perf_counter()
+        hashlib.pbkdf2_hmac('sha256', b'calibrate', b'0' * 16, probe)
+        per_iter = (time.perf_counter() - start) / probe
+        iterations = int(target_ms / 1000 / per_iter) // 10000 * 10000
+        self.iterations = max(PBKDF2_MIN_ITERATIONS, min(PBKDF2_MAX_ITERATIONS, iterations))
+        return self.iterations
+
+    def submit_hash_job(self, fn, *args):
+        # PBKDF2 — в отдельном ограниченном пуле, чтобы поток запросов не занимался
+        # хэшированием. Если пул и очередь заняты, возвращает None: такой запрос
+        # отклоняется сразу, а не копится.
+        if not self.hash_slots.acquire(blocking=False): return None
+        future = self.hash_pool.submit(fn, *args)
+        future.add_done_callback(lambda f: self.hash_slots.release())
+        return future
+
+    def rehash(self, password):
+        # Пароль верный, но параметры устарели: пересчитываем хэш в фоне
+        def run():
+            stored = self.config['password_hash']
+            if not self.needs_rehash(stored) or not self.verify_password(stored, password): return
+            self.save_config(dict(self.config, password_hash=self.hash_password(password)))
+        self.submit_hash_job(run)
+
+    def use_state_db(self, path):
+        self.throttle = SqliteThrottle(path)
+        self.sessions = SqliteSessions(path)
+
     def check_brute_force(self, ip):
-        now = time.time()
-        if ip in self.login_attempts:
-            last_time, count = self.login_attempts[ip]
-            if count >= MAX_LOGIN_ATTEMPTS:
-                if now - last_time < LOCKOUT_TIME:
-                    return False
-                else:
-                    self.login_attempts[ip] = [now, 0]
-        return True
+        return self.throttle.allowed(ip)
+
+    def acquire_attempt(self, ip):
+        # Проверка и учёт попытки атомарно: параллельные запросы с одного IP
+        # не могут проскочить лимит, пока пароль ещё проверяется.
+        return self.throttle.hit(ip)
 
     def register_attempt(self, ip, success):
-        now = time.time()
-        if success:
-            if ip in self.login_attempts: del self.login_attempts[ip]
-        else:
-            if ip not in self.login_attempts: self.login_attempts[ip] = [now, 0]
-            self.login_attempts[ip][1] += 1
-            self.login_attempts[ip][0] = now
+        # Неудачная попытка уже списана в acquire_attempt; удачный вход обнуляет корзину
+        if success: self.throttle.reset(ip)
 
     def generate_token(self):
-        return hmac.new(
-            bytes.fromhex(self.config['secret_key']),
-            str(time.time()).encode(),
-            hashlib.sha256
-        ).hexdigest()
+        return hmac.new(self.key, str(time.time()).encode(), hashlib.sha256).hexdigest()
 
     def sign_cookie(self, value):
         msg = base64.b64encode(value.encode()).decode()
-        sig = hmac.new(bytes.fromhex(self.config['secret_key']), msg.encode(), hashlib.sha256).hexdigest()
+        sig = hmac.new(self.key, msg.encode(), hashlib.sha256).hexdigest()
         return f"{msg}.{sig}"
 
     def unsign_cookie(self, signed_value):
         try:
             msg, sig = signed_value.split('.')
-            expected_sig = hmac.new(bytes.fromhex(self.config['secret_key']), msg.encode(), hashlib.sha256).hexdigest()
+            expected_sig = hmac.new(self.key, msg.encode(), hashlib.sha256).hexdigest()
             if hmac.compare_digest(sig, expected_sig):
                 return base64.b64decode(msg).decode()
         except:
             pass
         return None
 
+    # --- СЕССИИ ---
+    # Cookie содержит подписанный случайный id; сама сессия лежит в хранилище
+    # (память процесса или --state-db) и может быть отозвана. Уже проверенные
+    # подписи кэшируются, так что обычный запрос админки обходится без HMAC.
+
+    def create_session(self):
+        sid = secrets.token_urlsafe(32)
+        self.sessions.put(sid, time.time() + SESSION_TTL)
+        return self.sign_cookie(sid)
+
+    def check_session(self, token):
+        if not token: return None
+        with self.lock:
+            sid = self.verified.get(token)
+            if sid is not None: self.verified.move_to_end(token)
+        if sid is None:
+            self.refresh_config()
+            sid = self.unsign_cookie(token)
+            if sid is None: return None
+            with self.lock:
+                self.verified[token] = sid
+                if len(self.verified) > SESSION_CACHE_SIZE: self.verified.popitem(last=False)
+        expires = self.sessions.get(sid)
+        if expires is None: return None
+        if expires < time.time():
+            self.sessions.delete(sid)
+            with self.lock: self.verified.pop(token, None)
+            return None
+        return sid
+
+    def revoke_session(self, token):
+        sid = self.check_session(token)
+        with self.lock: self.verified.pop(token, None)
+        if sid: self.sessions.delete(sid)
+
+    def revoke_other_sessions(self, keep_sid):
+        self.sessions.keep_only(keep_sid)
+        with self.lock:
+            self.verified = OrderedDict((t, sid) for t, sid in self.verified.items() if sid == keep_sid)
+
+    def sweep(self):
+        self.throttle.sweep()
+        self.sessions.sweep(time.time())
+        with self.lock: cached = list(self.verified.items())
+        dead = [t for t, sid in cached if self.sessions.get(sid) is None]
+        with self.lock:
+            for token in dead: self.verified.pop(token, None)
+
+    def start_sweeper(self):
+        def loop():
+            while True:
+                time.sleep(SESSION_SWEEP_INTERVAL)
+                self.sweep()
+        threading.Thread(target=loop, name='cms-session-sweeper', daemon=True).start()
+
 security = SecurityManager()
 
+# --- КЭШ СТАТИКИ ---
+class StaticCache:
+    # LRU по пути; запись актуальна, пока совпадают mtime и размер файла
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entry=CACHE_MAX_ENTRY):
+        self.max_bytes = max_bytes
+        self.max_entry = max_entry
+        self.entries = OrderedDict()  # path -> entry
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        try: st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                entry['checked'] = time.monotonic()
+                return entry
+            self.misses += 1
+        try: entry = self.load(path)
+        except OSError: return None
+        with self.lock:
+            self.remove(path)
+            self.entries[path] = entry
+            self.size += entry['weight']
+            while self.size > self.max_bytes and self.entries:
+                self.remove(next(iter(self.entries)))
+        return entry
+
+    def peek(self, path):
+        # Без обращения к диску: запись, которую get() сверял с файлом не раньше
+        # CACHE_RECHECK назад (цикл событий --async), иначе None
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or time.monotonic() - entry['checked'] > CACHE_RECHECK: return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            body = f.read() if st.st_size <= self.max_entry else None
+        digest = hashlib.sha1(body).hexdigest() if body is not None else None
+        etag = '"%s"' % digest[:20] if digest else '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+        ext = os.path.splitext(path)[1].lower()
+        return {
+            'digest': digest[:fingerprint.HASH_LEN] if digest else None,  # большие файлы — см. digest()
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'body': body,
+            'etag': etag,
+            'last_modified': email.utils.formatdate(st.st_mtime, usegmt=True),
+            'ctype': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'cache_control': CACHE_CONTROL_HTML if ext in ('.html', '.htm') else CACHE_CONTROL_ASSETS,
+            'compressible': body is not None and ext in COMPRESS_EXT and len(body) >= COMPRESS_MIN_SIZE,
+            'variants': {},  # encoding -> (body, etag)
+            'weight': len(body) if body is not None else 0,
+            'checked': time.monotonic(),
+        }
+
+    def digest(self, path, entry):
+        # Хэш содержимого для сверки с ?v=. Большой файл не хэшируем при загрузке:
+        # хэш берётся из манифеста fingerprint.py, а без него считается по файлу
+        # один раз на версию — и только когда в URL есть ?v=
+        if entry['digest'] is None:
+            info = fingerprint.load_manifest().get('assets', {}).get(fingerprint.rel(path))
+            if info and info['mtime'] == entry['mtime'] and info['size'] == entry['size']: entry['digest'] = info['hash']
+            else:
+                try: entry['digest'] = fingerprint.file_hash(path)
+                except OSError: return None
+        return entry['digest']
+
+    def variant(self, path, entry, encoding):
+        # Сжатая версия строится один раз на каждую версию файла
+        v = entry['variants'].get(encoding)
+        if v: return v
+        if encoding == 'br': body = brotli.compress(entry['body'], quality=11)
+        else: body = gzip.compress(entry['body'], 9, mtime=0)
+        v = (body, entry['etag'][:-1] + '-' + encoding + '"')
+        with self.lock:
+            if encoding not in entry['variants']:
+                entry['variants'][encoding] = v
+                entry['weight'] += len(body)
+                if self.entries.get(path) is entry: self.size += len(body)
+        return v
+
+    def warm(self, paths):
+        # Заранее загружаем и сжимаем файлы, чтобы первый запрос не ждал
+        for path in paths:
+            entry = self.get(path)
+            if not entry or not entry['compressible']: continue
+            self.variant(path, entry, 'gzip')
+            if brotli: self.variant(path, entry, 'br')
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry: self.size -= entry['weight']
+
+    def invalidate(self, path):
+        # path может быть папкой — сбрасываем всё поддерево
+        prefix = os.path.join(path, '')
+        with self.lock:
+            for p in [p for p in self.entries if p == path or p.startswith(prefix)]:
+                self.remove(p)
+
+static_cache = StaticCache()
+
+def accepted_encoding(header):
+    # Разбор Accept-Encoding с q-значениями; br предпочтительнее gzip
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try: q = float(params.strip()[2:])
+            except ValueError: q = 0.0
+        accepted[name.strip().lower()] = q
+    for enc in ('br', 'gzip'):
+        if enc == 'br' and not brotli: continue
+        if accepted.get(enc, accepted.get('*', 0)) > 0: return enc
+    return None
+
+def iter_site_files(exts):
+    for root, dirs, files in os.walk(ROOT_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in EXCLUDE_FILES]
+        for name in files:
+            if name not in EXCLUDE_FILES and os.path.splitext(name)[1].lower() in exts:
+                yield os.path.join(root, name)
+
+def warm_in_background(paths):
+    threading.Thread(target=static_cache.warm, args=(list(paths),), daemon=True).start()
+
+def sync_indexes():
+    # Страницы, изменённые мимо CMS, попадают в поиск и граф ссылок при старте;
+    # миниатюры исчезнувших картинок удаляются
+    search_index.index.sync()
+    ref_graph.graph.sync()
+    thumbs.sweep()
+
+def build_update(action):
+    # Правка страницы сборкой или переписыванием ссылок — через историю, под блокировкой пути
+    return lambda path, fn: history.update(path, fn, action)
+
+def run_builds(*paths):
+    # Сборочные шаги после сохранения через CMS: шаблоны страниц, CSS-бандл,
+    # затем ?v= у ссылок на ассеты. Перезаписанные страницы сбрасываются из кэша.
+    changed = []
+    try:
+        for path in paths: changed += build_pages.on_save(path, build_update('build'))
+        for p in list(paths) + list(changed): changed += build_css.on_save(p, build_update('css'))
+        for p in list(paths) + list(changed): changed += fingerprint.on_save(p, build_update('fingerprint'))
+    except Exception as e:
+        sys.stderr.write(f"Build failed: {e}\n")
+    changed = sorted(set(changed))
+    notify_change(*changed)
+    static_cache.warm(changed)
+
+# --- MULTIPART ---
+def iter_multipart(rfile, boundary, length):
+    # Потоковый разбор multipart/form-data: отдаёт (name, filename, chunks),
+    # где chunks — генератор кусков тела части. Его нужно дочитать до конца.
+    delim = b'\r\n--' + boundary
+    state = {'buf': b'\r\n', 'left': length}
+
+    def fill():
+        if state['left'] <= 0: return False
+        data = rfile.read(min(UPLOAD_CHUNK, state['left']))
+        if not data: raise ValueError("Unexpected end of upload")
+        state['left'] -= len(data)
+        state['buf'] += data
+        return True
+
+    def read_until(marker, limit):
+        while marker not in state['buf']:
+            if len(state['buf']) > limit or not fill(): raise ValueError("Malformed multipart body")
+        head, _, state['buf'] = state['buf'].partition(marker)
+        return head
+
+    def body():
+        while True:
+            idx = state['buf'].find(delim)
+            if idx >= 0:
+                chunk, state['buf'] = state['buf'][:idx], state['buf'][idx + len(delim):]
+                if chunk: yield chunk
+                return
+            # Хвост может оказаться началом разделителя — его оставляем в буфере
+            keep = len(delim) - 1
+            if len(state['buf']) > keep:
+                chunk, state['buf'] = state['buf'][:-keep], state['buf'][-keep:]
+                yield chunk
+            if not fill(): raise ValueError("Unexpected end of upload")
+
+    read_until(delim, 1024)
+    while True:
+        while len(state['buf']) < 2:
+            if not fill(): raise ValueError("Malformed multipart body")
+        if state['buf'].startswith(b'--'): return
+        head = read_until(b'\r\n\r\n', 16 * 1024).decode('utf-8', 'replace')
+        disposition = ''
+        for line in head.split('\r\n'):
+            key, _, value = line.partition(':')
+            if key.strip().lower() == 'content-disposition': disposition = value
+        params = dict(re.findall(r';\s*(\w+)="([^"]*)"', disposition))
+        chunks = body()
+        yield params.get('name'), params.get('filename'), chunks
+        for _ in chunks: pass
+
+# --- ИНДЕКС ФАЙЛОВ ---
+class FileIndex:
+    # Дерево файлов в памяти: строится один раз, затем папки пересканируются
+    # точечно — после мутаций через CMS или если у папки сменился mtime
+    def __init__(self, root):
+        self.root = root
+        self.dirs = {}  # abs dir -> {'mtime': ns, 'items': [...]}
+        self.lock = threading.Lock()
+
+    def make_item(self, entry):
+        if entry.name.startswith('.') or entry.name in EXCLUDE_FILES: return None
+        is_dir = entry.is_dir()
+        if not is_dir and os.path.splitext(entry.name)[1].lower() not in ALLOWED_EXT: return None
+        item = {
+            'name': entry.name,
+            'path': os.path.relpath(entry.path, self.root).replace('\\', '/'),
+            'type': 'folder' if is_dir else 'file'
+        }
+        if not is_dir:
+            st = entry.stat()
+            item['size'] = st.st_size
+            item['mtime'] = int(st.st_mtime)
+        return item
+
+    def scan_dir(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                items = [i for i in map(self.make_item, it) if i]
+        except OSError:
+            self.drop(directory)
+            return
+        items.sort(key=lambda x: (x['type'] != 'folder', x['name']))
+        self.dirs[directory] = {'mtime': mtime, 'items': items}
+        subdirs = {os.path.join(directory, i['name']) for i in items if i['type'] == 'folder'}
+        for d in [d for d in self.dirs if os.path.dirname(d) == directory and d not in subdirs]:
+            self.drop(d)
+        for d in subdirs:
+            if d not in self.dirs: self.scan_dir(d)
+
+    def drop(self, directory):
+        prefix = os.path.join(directory, '')
+        for d in [d for d in self.dirs if d == directory or d.startswith(prefix)]:
+            del self.dirs[d]
+
+    def sync(self):
+        if not self.dirs:
+            self.scan_dir(self.root)
+            return
+        for d in list(self.dirs):
+            info = self.dirs.get(d)
+            if info is None: continue
+            try: changed = os.stat(d).st_mtime_ns != info['mtime']
+            except OSError: changed = True
+            if changed: self.scan_dir(d)
+
+    def touch(self, path):
+        # path изменён через CMS: пересканировать его папку (и его самого, если это папка)
+        with self.lock:
+            if not self.dirs: return
+            parent = os.path.dirname(path)
+            while parent not in self.dirs and parent.startswith(self.root) and parent != self.root:
+                parent = os.path.dirname(parent)
+            self.scan_dir(parent)
+            if os.path.isdir(path): self.scan_dir(path)
+
+    def tree(self, directory=None):
+        with self.lock:
+            self.sync()
+            return self.build_tree(directory or self.root)
+
+    def build_tree(self, directory):
+        out = []
+        for item in self.dirs.get(directory, {'items': []})['items']:
+            item = dict(item)
+            if item['type'] == 'folder':
+                item['children'] = self.build_tree(os.path.join(directory, item['name']))
+            out.append(item)
+        return out
+
+    def query(self, root=None, kind=None, offset=0, limit=None):
+        # Плоский список с фильтром и пагинацией: kind = images | files | folders | .ext
+        base = root or self.root
+        prefix = os.path.join(base, '')
+        with self.lock:
+            self.sync()
+            found = [i for d, info in self.dirs.items() if d == base or d.startswith(prefix) for i in info['items']]
+        if kind == 'images': found = [i for i in found if i['type'] == 'file' and os.path.splitext(i['name'])[1].lower() in IMAGE_EXT]
+        elif kind == 'files': found = [i for i in found if i['type'] == 'file']
+        elif kind == 'folders': found = [i for i in found if i['type'] == 'folder']
+        elif kind and kind.startswith('.'): found = [i for i in found if i['name'].lower().endswith(kind.lower())]
+        found.sort(key=lambda x: x['path'])
+        page = found[offset:offset + limit] if limit else found[offset:]
+        return {'items': page, 'total': len(found), 'offset': offset}
+
+file_index = FileIndex(ROOT_DIR)
+
+# --- ТАБЛИЦА МАРШРУТОВ ---
+DIRECTORY = object()  # папка: редирект на '/', индекс или листинг делает SimpleHTTPRequestHandler
+
+class RouteTable:
+    # URL -> файл для публичных GET без единого stat: '/coins.html' и '/coins'
+    # ведут на coins.html, '/dir/' — на dir/index.html, '/dir' — на DIRECTORY.
+    # Строится обходом сайта; папки пересканируются при смене mtime (проверка
+    # не чаще ROUTE_REFRESH) и сразу после мутаций через CMS. Написания, которых
+    # нет в таблице (%20, //, ..), разрешаются медленно один раз и запоминаются:
+    # найденные — в aliases, 404 — в misses. Оба кэша ограничены и сбрасываются
+    # при любом изменении таблицы.
+    def __init__(self, root, max_cached=ROUTE_CACHE_SIZE):
+        self.root = root
+        self.max_cached = max_cached
+        self.dirs = {}     # abs dir -> (mtime_ns, [URL, добавленные этой папкой])
+        self.routes = {}   # URL -> abs path | DIRECTORY
+        self.aliases = {}
+        self.misses = {}
+        self.checked = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+        return '/' if rel == '.' else '/' + rel
+
+    def scan_dir(self, directory):
+        # Вызывается под lock
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = [(e.name, e.is_dir()) for e in it if e.name not in EXCLUDE_FILES]
+        except OSError:
+            self.drop(directory)
+            return
+        self.forget(directory)
+        base = self.url(directory).rstrip('/')
+        added = {}
+        # Приоритет как у прежнего do_GET: файл, затем чистый URL к .html, затем папка
+        for name, is_dir in entries:
+            if not is_dir: added[base + '/' + name] = os.path.join(directory, name)
+        for name, is_dir in entries:
+            if not is_dir and name.endswith('.html'): added.setdefault(base + '/' + name[:-5], os.path.join(directory, name))
+        for name, is_dir in entries:
+            if is_dir: added.setdefault(base + '/' + name, DIRECTORY)
+        index = os.path.join(directory, 'index.html')
+        added[base + '/'] = index if ('index.html', False) in entries else DIRECTORY
+        self.routes.update(added)
+        self.dirs[directory] = (mtime, list(added))
+        subdirs = {os.path.join(directory, name) for name, is_dir in entries if is_dir}
+        for d in [d for d in self.dirs if os.path.dirname(d) == directory and d not in subdirs]:
+            self.drop(d)
+        for d in subdirs:
+            if d not in self.dirs: self.scan_dir(d)
+
+    def forget(self, directory):
+        for url in self.dirs.pop(directory, (0, []))[1]: self.routes.pop(url, None)
+
+    def drop(self, directory):
+        prefix = os.path.join(directory, '')
+        for d in [d for d in self.dirs if d == directory or d.startswith(prefix)]:
+            self.forget(d)
+
+    def changed(self):
+        self.aliases.clear()
+        self.misses.clear()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < ROUTE_REFRESH: return
+        with self.lock:
+            if now - self.checked < ROUTE_REFRESH: return
+            self.checked = now
+            if not self.dirs:
+                self.scan_dir(self.root)
+                self.changed()
+                return
+            stale = []
+            for d, (mtime, _) in list(self.dirs.items()):
+                try: current = os.stat(d).st_mtime_ns
+                except OSError: current = None
+                if current != mtime: stale.append(d)
+            for d in stale:
+                if d in self.dirs: self.scan_dir(d)
+            if stale: self.changed()
+
+    def touch(self, path):
+        # Мутация через CMS: пересканировать папку пути (и сам путь, если это папка)
+        with self.lock:
+            if not self.dirs: return
+            parent = os.path.dirname(path)
+            while parent not in self.dirs and parent.startswith(self.root) and parent != self.root:
+                parent = os.path.dirname(parent)
+            self.scan_dir(parent)
+            if os.path.isdir(path): self.scan_dir(path)
+            self.changed()
+
+    def peek(self, raw):
+        # Только из памяти, без сверки с диском (цикл событий --async)
+        found = self.routes.get(raw)
+        if found is None: found = self.aliases.get(raw)
+        if found is not None: self.hits += 1
+        return found
+
+    def lookup(self, raw, resolve):
+        # raw — путь из запроса как есть (без ?query); resolve(raw) — медленный путь
+        self.refresh()
+        for table in (self.routes, self.aliases):
+            found = table.get(raw)
+            if found is not None:
+                self.hits += 1
+                return found
+        if raw in self.misses: return None
+        found = resolve(raw)
+        with self.lock:
+            cache = self.aliases if found is not None else self.misses
+            cache[raw] = found
+            while len(cache) > self.max_cached: del cache[next(iter(cache))]
+        return found
+
+route_table = RouteTable(ROOT_DIR)
+
+# --- АТОМАРНАЯ ЗАПИСЬ И ИСТОРИЯ ---
+def fsync_dir(directory):
+    # Чтобы os.replace пережил сбой питания (на Windows папку не открыть — пропускаем)
+    if os.name != 'posix': return
+    fd = os.open(directory, os.O_RDONLY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+def atomic_write(path, data):
+    # Временный файл рядом + fsync + os.replace: читатель видит либо старую,
+    # либо новую версию целиком, но никогда не обрезанную
+    directory = os.path.dirname(path)
+    try: mode = os.stat(path).st_mode & 0o777
+    except OSError: mode = 0o644
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    fsync_dir(directory)
+
+class HistoryObject:
+    # Объект истории, записываемый по мере приёма данных: sha1 и zlib считаются
+    # на лету, так что загруженный файл не перечитывается ради истории.
+    # Больше HISTORY_MAX_FILE — объект отбрасывается, close() вернёт None
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.sha1()
+        self.zip = zlib.compressobj(6)
+        self.size = 0
+        os.makedirs(store.objects, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(prefix='.object-', dir=store.objects)
+        self.f = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.f is None: return
+        if self.size > HISTORY_MAX_FILE: self.discard(); return
+        self.hash.update(chunk)
+        self.f.write(self.zip.compress(chunk))
+
+    def discard(self):
+        if self.f: self.f.close()
+        self.f = None
+        if os.path.exists(self.tmp): os.remove(self.tmp)
+
+    def close(self):
+        if self.f is None: return None
+        self.f.write(self.zip.flush())
+        self.f.close()
+        self.f = None
+        oid = self.hash.hexdigest()
+        path = self.store.object_path(oid)
+        if os.path.exists(path): os.remove(self.tmp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp, path)
+        return oid
+
+class HistoryStore:
+    # Версии файлов, адресуемые по содержимому: objects/ab/cdef... (zlib),
+    # одинаковое содержимое хранится один раз. log.jsonl — журнал
+    # {file, id, size, time, action}, из него при старте строится индекс.
+    # Выросший журнал сжимается: у каждого файла остаются HISTORY_MAX_VERSIONS
+    # последних версий, объекты без ссылок удаляются.
+    def __init__(self, directory):
+        self.dir = directory
+        self.objects = os.path.join(directory, 'objects')
+        self.log_file = os.path.join(directory, 'log.jsonl')
+        self.versions = {}  # rel path -> [entry, ...] (старые первыми)
+        self.offset = 0     # сколько байт журнала уже прочитано
+        self.lines = 0      # сколько в нём записей
+        self.inode = None   # после сжатия журнал — новый файл, читаем его с начала
+        self.lock = threading.Lock()
+        self.path_locks = {}  # abs path -> RLock: запись файла и правка сборкой не пересекаются
+        self.load()
+
+    def load(self):
+        # Дочитывает журнал с последней позиции: в него пишут и другие процессы
+        # (--processes), так что индекс догоняется перед каждым обращением
+        try:
+            with open(self.log_file, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self.inode:
+                    self.versions, self.offset, self.lines, self.inode = {}, 0, 0, st.st_ino
+                if st.st_size == self.offset: return
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'): break  # строку ещё дописывают
+                    self.offset += len(line)
+                    self.lines += 1
+                    try: entry = json.loads(line)
+                    except ValueError: continue  # недописанная строка после сбоя
+                    self.apply(entry)
+        except OSError: pass
+
+    def apply(self, entry):
+        if entry['action'] == 'rename':
+            # Переименование файла или папки: история переезжает вместе с путями
+            old, new = entry['from'], entry['file']
+            for rel in [r for r in self.versions if r == old or r.startswith(old + '/')]:
+                self.versions.setdefault(new + rel[len(old):], []).extend(self.versions.pop(rel))
+        else:
+            self.versions.setdefault(entry['file'], []).append(entry)
+
+    def object_path(self, oid):
+        return os.path.join(self.objects, oid[:2], oid[2:])
+
+    def put(self, data):
+        oid = hashlib.sha1(data).hexdigest()
+        path = self.object_path(oid)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # fsync здесь не нужен: объект пишется до подмены живого файла,
+            # а потерянный после сбоя объект просто не показывается в списке
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f: f.write(zlib.compress(data, 6))
+            os.replace(tmp, path)
+        return oid
+
+    def get(self, oid):
+        if not re.fullmatch(r'[0-9a-f]{40}', oid or ''): return None
+        try:
+            with open(self.object_path(oid), 'rb') as f: return zlib.decompress(f.read())
+        except (OSError, zlib.error): return None
+
+    def append(self, entry):
+        # Вызывается под self.lock
+        # Одна строка — одна запись в режиме append, строки процессов не перемешиваются;
+        # в индекс она попадает при дочитывании вместе с чужими
+        os.makedirs(self.dir, exist_ok=True)
+        while True:
+            with open(self.log_file, 'ab') as f:
+                # Общая блокировка против сжатия; если журнал подменили, пока ждали, — пишем в новый
+                if fcntl: fcntl.flock(f, fcntl.LOCK_SH)
+                if fcntl and os.fstat(f.fileno()).st_ino != os.stat(self.log_file).st_ino: continue
+                f.write(json.dumps(entry).encode('utf-8') + b'\n')
+            break
+        self.load()
+        kept = sum(min(len(v), HISTORY_MAX_VERSIONS) for v in self.versions.values())
+        if self.offset > HISTORY_COMPACT_SIZE and self.lines > 2 * kept: self.compact()
+
+    def compact(self):
+        # Вызывается под self.lock. Журнал переписывается целиком: по файлу — последние
+        # HISTORY_MAX_VERSIONS версий под текущим именем (переименования уже учтены)
+        with open(self.log_file, 'ab') as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.load()
+            entries = [dict(e, file=rel) for rel, versions in self.versions.items() for e in versions[-HISTORY_MAX_VERSIONS:]]
+            tmp = self.log_file + '.tmp'
+            with open(tmp, 'wb') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.log_file)
+        self.load()
+        # Объекты без ссылок; совсем свежие могут принадлежать записи, которая ещё идёт
+        keep = {e['id'] for e in entries}
+        cutoff = time.time() - HISTORY_OBJECT_GRACE
+        for root, _, files in os.walk(self.objects):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.basename(root) + name not in keep and os.path.getmtime(path) < cutoff: os.remove(path)
+                except OSError: pass
+
+    def rel(self, path):
+        return os.path.relpath(path, ROOT_DIR).replace('\\', '/')
+
+    def snapshot(self, path, action):
+        # Текущее содержимое файла — в историю, если его там ещё нет
+        try:
+            if os.path.getsize(path) > HISTORY_MAX_FILE: return
+            with open(path, 'rb') as f: data = f.read()
+        except OSError: return
+        self.record(path, data, action)
+
+    def record(self, path, data, action):
+        if len(data) > HISTORY_MAX_FILE: return
+        self.add(path, self.put(data), len(data), action)
+
+    def stream(self):
+        # Для загрузок: объект пишется вместе с временным файлом, потом add()
+        return HistoryObject(self)
+
+    def add(self, path, oid, size, action):
+        # Запись в журнал об уже сохранённом объекте
+        rel = self.rel(path)
+        with self.lock:
+            self.load()
+            known = self.versions.get(rel)
+            if known and known[-1]['id'] == oid and action == 'original': return
+            self.append({'file': rel, 'id': oid, 'size': size, 'time': int(time.time()), 'action': action})
+
+    def path_lock(self, path):
+        with self.lock:
+            return self.path_locks.setdefault(path, threading.RLock())
+
+    def write(self, path, data, action='save'):
+        # Атомарная запись с журналом: прежняя версия (если её нет в истории),
+        # затем объект новой, затем подмена файла, затем строка в журнале
+        with self.path_lock(path):
+            with self.lock: self.load()
+            if os.path.isfile(path) and self.rel(path) not in self.versions:
+                self.snapshot(path, 'original')
+            oid = self.put(data) if len(data) <= HISTORY_MAX_FILE else None
+            atomic_write(path, data)
+            if oid:
+                with self.lock:
+                    self.append({'file': self.rel(path), 'id': oid, 'size': len(data), 'time': int(time.time()), 'action': action})
+
+    def update(self, path, fn, action):
+        # Чтение -> fn(текст) -> запись для сборочных шагов (build_pages, fingerprint,
+        # build_css, ссылки при переименовании). Под блокировкой пути /api/save не
+        # вклинится между чтением и записью; если файл успели сменить мимо CMS — не
+        # затираем. Несуществующий файл читается как пустой. True, если записали
+        with self.path_lock(path):
+            try:
+                st = os.stat(path)
+                with open(path, 'rb') as f: content = f.read().decode('utf-8')
+            except FileNotFoundError: st, content = None, ''
+            except (OSError, UnicodeDecodeError): return False
+            new_content = fn(content)
+            if new_content == content: return False
+            try: now = os.stat(path)
+            except FileNotFoundError: now = None
+            except OSError: return False
+            if (now and (now.st_mtime_ns, now.st_size)) != (st and (st.st_mtime_ns, st.st_size)): return False
+            self.write(path, new_content.encode('utf-8'), action)
+            return True
+
+    def renamed(self, old_path, new_path):
+        old = self.rel(old_path)
+        with self.lock:
+            self.load()
+            if any(r == old or r.startswith(old + '/') for r in self.versions):
+                self.append({'file': self.rel(new_path), 'from': self.rel(old_path), 'time': int(time.time()), 'action': 'rename'})
+
+    def list(self, path):
+        with self.lock:
+            self.load()
+            entries = list(self.versions.get(self.rel(path), []))
+        return [e for e in reversed(entries) if os.path.exists(self.object_path(e['id']))]
+
+history = HistoryStore(HISTORY_DIR)
+
+# --- МИНИАТЮРЫ ---
+class ThumbnailStore:
+    # Файлы <sha1 оригинала>-<размер>.webp: одинаковые картинки делят миниатюру,
+    # а сменившееся содержимое даёт новый ключ. Хэш оригинала запоминается
+    # по (mtime, size), чтобы не перечитывать его на каждый запрос.
+    def __init__(self, root, workers=THUMB_WORKERS):
+        self.root = root
+        self.digests = {}  # abs path -> (mtime_ns, size, sha1)
+        self.pending = {}  # путь миниатюры -> Future
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb')
+        self.ext, self.format = ('.webp', 'WEBP') if Image and features.check('webp') else ('.jpg', 'JPEG')
+
+    def supports(self, path):
+        return Image is not None and os.path.splitext(path)[1].lower() in IMAGE_EXT - {'.svg'}
+
+    def size(self, requested):
+        return next((s for s in THUMB_SIZES if s >= requested), THUMB_SIZES[-1])
+
+    def digest(self, path):
+        st = os.stat(path)
+        with self.lock:
+            known = self.digests.get(path)
+        if known and known[:2] == (st.st_mtime_ns, st.st_size): return known[2]
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK), b''): h.update(chunk)
+        with self.lock:
+            self.digests[path] = (st.st_mtime_ns, st.st_size, h.hexdigest())
+        return h.hexdigest()
+
+    def thumb_path(self, digest, size):
+        return os.path.join(self.root, digest[:2], f'{digest}-{size}{self.ext}')
+
+    def get(self, path, size, wait=THUMB_WAIT):
+        # Путь к готовой миниатюре или None (не успели / не смогли)
+        target = self.thumb_path(self.digest(path), size)
+        if os.path.exists(target): return target
+        try: self.submit(path, target, size).result(wait)
+        except Exception: return None
+        return target if os.path.exists(target) else None
+
+    def prefetch(self, path, size=THUMB_SIZES[0]):
+        # Фоном после загрузки: к открытию медиатеки миниатюра уже готова
+        if not self.supports(path): return
+        try: target = self.thumb_path(self.digest(path), size)
+        except OSError: return
+        if not os.path.exists(target): self.submit(path, target, size)
+
+    def submit(self, path, target, size):
+        # Один и тот же файл генерируется один раз, сколько бы запросов его ни ждали
+        with self.lock:
+            future = self.pending.get(target)
+            if future is None:
+                future = self.pending[target] = self.pool.submit(self.generate, path, target, size)
+            return future
+
+    def generate(self, path, target, size):
+        try:
+            with Image.open(path) as im:
+                im.draft('RGB', (size, size))  # JPEG декодируется сразу в уменьшенном масштабе
+                im = ImageOps.exif_transpose(im)
+                im.thumbnail((size, size))
+                alpha = self.format == 'WEBP' and (im.mode in ('RGBA', 'LA') or 'transparency' in im.info)
+                im = im.convert('RGBA' if alpha else 'RGB')
+                buf = io.BytesIO()
+                im.save(buf, self.format, quality=THUMB_QUALITY)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(target))
+            with os.fdopen(fd, 'wb') as f: f.write(buf.getvalue())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)
+        except Exception as e:
+            sys.stderr.write(f"Thumbnail failed for {path}: {e}\n")
+        finally:
+            with self.lock: self.pending.pop(target, None)
+
+    def invalidate(self, path):
+        # Запомненный хэш сбрасывается, только если файл исчез или сменился;
+        # миниатюры, на содержимое которых больше никто не ссылается, удаляются
+        prefix = os.path.join(path, '')
+        with self.lock:
+            affected = [p for p in self.digests if p == path or p.startswith(prefix)]
+        dropped = set()
+        for p in affected:
+            try:
+                st = os.stat(p)
+                current = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                current = None
+            with self.lock:
+                known = self.digests.get(p)
+                if known and known[:2] != current: dropped.add(self.digests.pop(p)[2])
+        with self.lock:
+            dropped -= {d[2] for d in self.digests.values()}
+        self.remove(dropped)
+
+    def renamed(self, old, new):
+        # Содержимое не менялось — хэши переезжают на новые пути, миниатюры остаются
+        prefix = os.path.join(old, '')
+        with self.lock:
+            for p in [p for p in self.digests if p == old or p.startswith(prefix)]:
+                self.digests[new + p[len(old):]] = self.digests.pop(p)
+
+    def remove(self, digests):
+        for digest in digests:
+            for size in THUMB_SIZES:
+                try: os.remove(self.thumb_path(digest, size))
+                except OSError: pass
+
+    def sweep(self):
+        # При старте: хэши в памяти пропали вместе с прошлым процессом, поэтому
+        # миниатюры картинок, удалённых или изменённых тогда (или мимо CMS), ищем
+        # сверкой со всеми картинками сайта
+        if not os.path.isdir(self.root): return 0
+        live = set()
+        for path in iter_site_files(IMAGE_EXT - {'.svg'}):
+            try: live.add(self.digest(path))
+            except OSError: pass
+        orphans = set()
+        for directory, _, files in os.walk(self.root):
+            orphans.update(name.split('-', 1)[0] for name in files if not name.startswith('.'))
+        with self.lock:
+            orphans -= live | {d[2] for d in self.digests.values()}
+        self.remove(orphans)
+        return len(orphans)
+
+thumbs = ThumbnailStore(THUMB_DIR)
+
+def notify_change(*paths):
+    # Единая точка для всех мутаций через CMS: сбрасывает кэши и индексы
+    for path in paths:
+        static_cache.invalidate(path)
+        file_index.touch(path)
+        route_table.touch(path)
+        thumbs.invalidate(path)
+    # Поисковый индекс и граф ссылок сохраняются на диск — одной записью на всю пачку путей
+    search_index.on_change(*paths)
+    ref_graph.on_change(*paths)
+
+# --- МЕТРИКИ ---
+API_ROUTES = {'/api/list', '/api/load', '/api/search', '/api/refs', '/api/thumb', '/api/history', '/api/metrics', '/api/save', '/api/restore', '/api/upload',
+              '/api/create_file', '/api/create_folder', '/api/delete', '/api/rename', '/api/change_password'}
+
+class Metrics:
+    # Счётчики по маршрутам: (method, route) -> число по статусам, байты, гистограмма времени.
+    # Маршрутов конечное число, поэтому метрики не растут вместе с числом URL.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = 0
+        self.rejected = 0
+        self.routes = {}
+        self.paths = {}  # url path -> [count, bytes]
+
+    def begin(self):
+        with self.lock: self.in_flight += 1
+
+    def finish(self, method, route, path, status, size, elapsed):
+        i = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self.lock:
+            self.in_flight -= 1
+            r = self.routes.get((method, route))
+            if r is None:
+                r = self.routes[(method, route)] = {'statuses': {}, 'count': 0, 'bytes': 0, 'sum': 0.0,
+                                                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            r['statuses'][status] = r['statuses'].get(status, 0) + 1
+            r['count'] += 1
+            r['bytes'] += size
+            r['sum'] += elapsed
+            r['buckets'][i] += 1
+            if path not in self.paths and len(self.paths) >= METRICS_MAX_PATHS: path = '(other)'
+            p = self.paths.setdefault(path, [0, 0])
+            p[0] += 1
+            p[1] += size
+
+    def reject(self):
+        with self.lock: self.rejected += 1
+
+    def snapshot(self, server=None):
+        with self.lock:
+            routes = [{'method': m, 'route': r, 'count': v['count'], 'bytes': v['bytes'], 'seconds': round(v['sum'], 6),
+                       'statuses': dict(v['statuses']), 'buckets': list(v['buckets'])}
+                      for (m, r), v in sorted(self.routes.items())]
+            top = sorted(self.paths.items(), key=lambda x: -x[1][1])[:50]
+            data = {'pid': os.getpid(), 'uptime': round(time.time() - self.started, 1), 'in_flight': self.in_flight,
+                    'rejected': self.rejected, 'routes': routes,
+                    'top_paths': [{'path': p, 'count': c, 'bytes': b} for p, (c, b) in top]}
+        lookups = static_cache.hits + static_cache.misses
+        data['cache'] = {'hits': static_cache.hits, 'misses': static_cache.misses,
+                         'hit_ratio': round(static_cache.hits / lookups, 4) if lookups else None,
+                         'bytes': static_cache.size, 'entries': len(static_cache.entries)}
+        data['route_table'] = {'routes': len(route_table.routes), 'hits': route_table.hits,
+                               'aliases': len(route_table.aliases), 'misses': len(route_table.misses)}
+        data['queued'] = server.pending.qsize() if hasattr(server, 'pending') else 0
+        data['access_log_dropped'] = access_log.dropped
+        data['buckets'] = list(LATENCY_BUCKETS)
+        return data
+
+    def prometheus(self, server=None):
+        d = self.snapshot(server)
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lbl = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                out.append(f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}")
+
+        metric('nanocms_requests_total', 'counter', 'Requests by route and status',
+               [({'method': r['method'], 'route': r['route'], 'status': s}, n) for r in d['routes'] for s, n in sorted(r['statuses'].items())])
+        hist = []
+        for r in d['routes']:
+            labels = {'method': r['method'], 'route': r['route']}
+            total = 0
+            for le, n in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], r['buckets']):
+                total += n
+                hist.append((dict(labels, le=le), total))
+        out.append("# HELP nanocms_request_duration_seconds Time from request line to response flush")
+        out.append("# TYPE nanocms_request_duration_seconds histogram")
+        for labels, value in hist:
+            lbl = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            out.append(f"nanocms_request_duration_seconds_bucket{{{lbl}}} {value}")
+        for r in d['routes']:
+            lbl = f'method="{r["method"]}",route="{r["route"]}"'
+            out.append(f"nanocms_request_duration_seconds_sum{{{lbl}}} {r['seconds']}")
+            out.append(f"nanocms_request_duration_seconds_count{{{lbl}}} {r['count']}")
+        metric('nanocms_response_bytes_total', 'counter', 'Response body bytes',
+               [({'method': r['method'], 'route': r['route']}, r['bytes']) for r in d['routes']])
+        metric('nanocms_in_flight_requests', 'gauge', 'Requests being handled', [({}, d['in_flight'])])
+        metric('nanocms_queued_connections', 'gauge', 'Connections waiting for a worker', [({}, d['queued'])])
+        metric('nanocms_rejected_connections_total', 'counter', 'Connections refused with 503', [({}, d['rejected'])])
+        metric('nanocms_static_cache_hits_total', 'counter', 'Static cache hits', [({}, d['cache']['hits'])])
+        metric('nanocms_static_cache_misses_total', 'counter', 'Static cache misses', [({}, d['cache']['misses'])])
+        metric('nanocms_static_cache_bytes', 'gauge', 'Bytes held by the static cache', [({}, d['cache']['bytes'])])
+        metric('nanocms_route_table_hits_total', 'counter', 'Public URLs resolved from the route table', [({}, d['route_table']['hits'])])
+        metric('nanocms_route_negative_cache_entries', 'gauge', 'Remembered 404 URLs', [({}, d['route_table']['misses'])])
+        metric('nanocms_access_log_dropped_total', 'counter', 'Access log lines dropped on overflow', [({}, d['access_log_dropped'])])
+        metric('nanocms_uptime_seconds', 'gauge', 'Seconds since start', [({}, d['uptime'])])
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+
+class AccessLog:
+    # Журнал пишет отдельный поток: обработчик только кладёт запись в очередь.
+    # Пока поток не запущен (сервер импортирован как модуль) — пишем сразу в stderr.
+    def __init__(self):
+        self.path = None
+        self.queue = None
+        self.thread = None
+        self.dropped = 0
+
+    def start(self, path=None):
+        self.path = path
+        self.queue = queue.Queue(ACCESS_LOG_QUEUE)
+        self.thread = threading.Thread(target=self.run, name='cms-access-log', daemon=True)
+        self.thread.start()
+
+    def write(self, line=None, record=None):
+        if self.queue is None:
+            if line: sys.stderr.write(line)
+            return
+        try: self.queue.put_nowait((line, record))
+        except queue.Full: self.dropped += 1
+
+    def run(self):
+        f = open(self.path, 'a', encoding='utf-8') if self.path else None
+        try:
+            while True:
+                item = self.queue.get()
+                # Всё, что уже накопилось, пишем пачкой и сбрасываем буферы один раз
+                batch = [item]
+                while item is not None:
+                    try: item = self.queue.get_nowait()
+                    except queue.Empty: break
+                    batch.append(item)
+                for entry in batch:
+                    if entry is None: continue
+                    line, record = entry
+                    if line: sys.stderr.write(line)
+                    if record and f: f.write(json.dumps(record) + '\n')
+                sys.stderr.flush()
+                if f: f.flush()
+                if batch[-1] is None: return
+        finally:
+            if f: f.close()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join(SHUTDOWN_TIMEOUT)
+
+access_log = AccessLog()
+
 # --- ОБРАБОТЧИК ЗАПРОСОВ ---
 class CMSHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Заголовки и тело уходят отдельными send(); без TCP_NODELAY на keep-alive
+    # второй пакет ждёт delayed ACK клиента (~40 мс на каждый ответ)
+    disable_nagle_algorithm = True
+    on_loop = False  # AsyncServer: запрос обслуживается в цикле событий — только из памяти
+
+    def handle_one_request(self):
+        self.request_start = None
+        try: super().handle_one_request()
+        finally:
+            if self.request_start is not None: self.record_request()
+        # При остановке сервера не держим keep-alive соединение
+        if getattr(self.server, 'stopping', False): self.close_connection = True
+
+    def parse_request(self):
+        # Отсчёт с момента получения строки запроса (ожидание keep-alive не считается)
+        self.request_start = time.perf_counter()
+        self.response_status = None
+        self.response_bytes = 0
+        metrics.begin()
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length' and self.command != 'HEAD':
+            self.response_bytes = int(value)
+        super().send_header(keyword, value)
+
+    def route_label(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if self.response_status == 404: return 'not_found'
+        if path.startswith('/api/'): return path if path in API_ROUTES else '/api/other'
+        if path in ('/admin', '/admin/'): return '/admin'
+        if path in ('/login', '/logout'): return path
+        return 'page' if os.path.splitext(path)[1].lower() in ('', '.html', '.htm') else 'asset'
+
+    def record_request(self):
+        elapsed = time.perf_counter() - self.request_start
+        status = self.response_status or 0
+        metrics.finish(self.command or '-', self.route_label(), urllib.parse.urlsplit(self.path).path,
+                       status, self.response_bytes, elapsed)
+        if access_log.path:
+            access_log.write(record={'time': round(time.time(), 3), 'ip': self.client_address[0], 'method': self.command,
+                                     'path': self.path, 'status': status, 'bytes': self.response_bytes,
+                                     'ms': round(elapsed * 1000, 3), 'ua': getattr(self, 'headers', None) and self.headers.get('User-Agent')})
+
+    def log_message(self, format, *args):
+        # Та же строка, что у BaseHTTPRequestHandler, но через фоновый поток
+        access_log.write("%s - - [%s] %s\n" % (self.address_string(), self.log_date_time_string(), format % args))
+
     def get_client_ip(self):
         return self.client_address[0]
 
+    def session_token(self):
+        # Разбор одной cookie без SimpleCookie
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'nanocms_session': return value.strip('"')
+        return None
+
     def check_auth(self):
-        if "Cookie" in self.headers:
-            c = cookies.SimpleCookie(self.headers["Cookie"])
-            if "nanocms_session" in c:
-                signed_val = c["nanocms_session"].value
-                val = security.unsign_cookie(signed_val)
-                if val == "authorized":
-                    return True
-        return False
+        self.session_id = security.check_session(self.session_token())
+        return self.session_id is not None
+
+    def session_cookie(self, value, max_age):
+        c = cookies.SimpleCookie()
+        c["nanocms_session"] = value
+        c["nanocms_session"]["path"] = "/"
+        c["nanocms_session"]["httponly"] = True
+        c["nanocms_session"]["samesite"] = "Strict"
+        c["nanocms_session"]["max-age"] = max_age
+        return c.output(header="", sep="").strip()
+
+    def send_body(self, body, content_type, code=200, headers=None):
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD': self.wfile.write(body)
 
     def send_api_response(self, success, data=None, message=None):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
         resp = {'status': 'success' if success else 'error'}
         if data: resp['data'] = data
         if message: resp['message'] = message
-        self.wfile.write(json.dumps(resp).encode('utf-8'))
+        self.send_body(json.dumps(resp).encode('utf-8'), 'application/json')
+
+    def do_HEAD(self):
+        self.do_GET()
 
     def do_GET(self):
+        if self.path == '/logout':
+            security.revoke_session(self.session_token())
+            self.send_body(b'', 'text/plain', 302, headers={'Location': '/admin', 'Set-Cookie': self.session_cookie('', 0)})
+            return
+
         if self.path == '/admin' or self.path == '/admin/':
             if self.check_auth(): self.serve_ui()
             else: self.serve_login()
@@ -146,26 +1556,72 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_api_response(True, self.get_file_tree(ROOT_DIR))
                 return
 
+            if self.path.startswith('/api/list?'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                root = self.get_safe_path(query.get('root', [''])[0]) if query.get('root') else ROOT_DIR
+                if not root: self.send_api_response(False, message="Invalid path"); return
+                try:
+                    offset = max(0, int(query.get('offset', ['0'])[0]))
+                    limit = max(0, int(query.get('limit', ['0'])[0])) or None
+                except ValueError: self.send_api_response(False, message="Invalid paging"); return
+                kind = query.get('filter', [None])[0]
+                listing = file_index.query(root, kind, offset, limit)
+                if kind == 'images': listing['items'] = [self.with_digest(i) for i in listing['items']]
+                self.send_api_response(True, listing)
+                return
+
+            if self.path.startswith('/api/metrics'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                if query.get('format', [''])[0] == 'json' or 'application/json' in self.headers.get('Accept', ''):
+                    self.send_body(json.dumps(metrics.snapshot(self.server)).encode('utf-8'), 'application/json')
+                else:
+                    self.send_body(metrics.prometheus(self.server).encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+                return
+
+            if self.path.startswith('/api/search'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                try:
+                    limit = max(1, int(query.get('limit', ['20'])[0]))
+                    offset = max(0, int(query.get('offset', ['0'])[0]))
+                except ValueError: self.send_api_response(False, message="Invalid paging"); return
+                self.send_api_response(True, search_index.index.search(query.get('q', [''])[0], limit, offset))
+                return
+
+            if self.path.startswith('/api/refs'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                safe_path = self.get_safe_path(query.get('file', [''])[0])
+                if not safe_path: self.send_api_response(False, message="Invalid path"); return
+                self.send_api_response(True, {'file': ref_graph.graph.rel(safe_path),
+                                              'referrers': ref_graph.graph.referrers(safe_path),
+                                              'references': ref_graph.graph.references(safe_path)})
+                return
+
+            if self.path.startswith('/api/thumb'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                self.serve_thumb(query.get('file', [''])[0], query.get('w', [''])[0], query.get('v', [None])[0])
+                return
+
+            if self.path.startswith('/api/history'):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                self.serve_history(query.get('file', [''])[0], query.get('version', [None])[0])
+                return
+
             if self.path.startswith('/api/load'):
                 query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
                 filename = query.get('file', [''])[0]
                 self.serve_file_content(filename)
                 return
 
-        # Clean URL support: Try adding .html if file not found
-        safe_path = self.get_safe_path(self.path)
-        if not safe_path or not os.path.exists(safe_path):
-             if self.path.endswith('/'):
-                 # Directory index is handled by super().do_GET() or we can force it
-                 pass
-             else:
-                 # Try appending .html
-                 html_path = self.path + '.html'
-                 safe_html = self.get_safe_path(html_path)
-                 if safe_html and os.path.exists(safe_html):
-                     self.path = html_path
-
-        super().do_GET()
+        static_path = self.resolve_static()
+        if RENDER_TEMPLATES and static_path is not DIRECTORY:
+            static_path = self.render_template_page(static_path) or static_path
+        if static_path is DIRECTORY:
+            super().do_GET()
+        elif static_path:
+            self.serve_static(static_path)
+        else:
+            # Сюда же попадают служебные файлы (server.py, nanocms.json): их нет в таблице
+            self.send_error(404)
 
     def do_POST(self):
         if self.path == '/login':
@@ -174,22 +1630,24 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
             password = data.get('password', '')
             ip = self.get_client_ip()
 
-            if not security.check_brute_force(ip):
-                self.send_api_response(False, message="Too many attempts. Wait 5 min.")
+            security.refresh_config()
+            if not security.acquire_attempt(ip):
+                self.send_api_response(False, message="Too many attempts. Try again later.")
                 return
 
-            if security.verify_password(security.config['password_hash'], password):
+            job = security.submit_hash_job(security.verify_password, security.config['password_hash'], password)
+            if job is None:
+                self.send_body(json.dumps({'status': 'error', 'message': 'Server busy, try again'}).encode('utf-8'),
+                               'application/json', 503, headers={'Retry-After': '1'})
+                return
+
+            if job.result():
                 security.register_attempt(ip, True)
-                self.send_response(200)
-                c = cookies.SimpleCookie()
-                c["nanocms_session"] = security.sign_cookie("authorized")
-                c["nanocms_session"]["path"] = "/"
-                c["nanocms_session"]["httponly"] = True
-                self.send_header("Set-Cookie", c.output(header="", sep=""))
-                self.end_headers()
-                self.wfile.write(json.dumps({'status': 'success'}).encode('utf-8'))
+                if security.needs_rehash(security.config['password_hash']): security.rehash(password)
+                cookie = self.session_cookie(security.create_session(), SESSION_TTL)
+                self.send_body(json.dumps({'status': 'success'}).encode('utf-8'), 'application/json',
+                               headers={"Set-Cookie": cookie})
             else:
-                security.register_attempt(ip, False)
                 self.send_api_response(False, message="Invalid password")
             return
 
@@ -211,6 +1669,10 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
             else:
                 self.send_api_response(False, message="Write error")
 
+        elif self.path == '/api/restore':
+            if self.restore_version(data.get('file'), data.get('version')): self.send_api_response(True)
+            else: self.send_api_response(False, message="Restore error")
+
         elif self.path == '/api/create_file':
             if self.create_fs_item(data.get('path'), False): self.send_api_response(True)
             else: self.send_api_response(False, message="Create error")
@@ -220,52 +1682,207 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
             else: self.send_api_response(False, message="Create error")
 
         elif self.path == '/api/delete':
-            if self.delete_fs_item(data.get('path')): self.send_api_response(True)
+            # Страницы, чьи ссылки теперь битые, возвращаются в ответе
+            safe_path = self.get_safe_path(data.get('path'))
+            referrers = ref_graph.graph.referrers(safe_path) if safe_path else []
+            if self.delete_fs_item(data.get('path')): self.send_api_response(True, {'referrers': referrers} if referrers else None)
             else: self.send_api_response(False, message="Delete error")
 
         elif self.path == '/api/rename':
-            if self.rename_fs_item(data.get('old_path'), data.get('new_name')): self.send_api_response(True)
+            updated = self.rename_fs_item(data.get('old_path'), data.get('new_name'), bool(data.get('update_refs')))
+            if updated is not None: self.send_api_response(True, {'updated': updated} if updated else None)
             else: self.send_api_response(False, message="Rename error")
 
         elif self.path == '/api/change_password':
             new_pass = data.get('password')
-            if new_pass:
-                conf = security.config
-                conf['password_hash'] = security.hash_password(new_pass)
-                security.save_config(conf)
+            security.refresh_config()
+            job = security.submit_hash_job(security.hash_password, new_pass) if new_pass else None
+            if new_pass and job is None:
+                self.send_api_response(False, message="Server busy, try again")
+            elif new_pass:
+                security.save_config(dict(security.config, password_hash=job.result()))
+                # Смена пароля выкидывает все остальные сессии
+                security.revoke_other_sessions(self.session_id)
                 self.send_api_response(True)
             else: self.send_api_response(False, message="Empty password")
 
         else: self.send_error(404)
 
+    # --- СТАТИКА ---
+
+    def resolve_static(self):
+        # Файл, DIRECTORY или None (404)
+        if self.on_loop:
+            found = route_table.peek(self.path.split('?', 1)[0].split('#', 1)[0])
+            if found is not None: return found
+        return route_table.lookup(self.path.split('?', 1)[0].split('#', 1)[0], self.resolve_path)
+
+    def resolve_path(self, raw):
+        # Медленный путь: нормализуем написание и ищем в таблице ещё раз, а если
+        # файла там нет (появился мимо CMS, ещё до сверки) — спрашиваем диск
+        url_path = urllib.parse.unquote(raw)
+        safe_path = self.get_safe_path(url_path)
+        if not safe_path: return None
+        url = route_table.url(safe_path)
+        found = route_table.routes.get(url + '/' if url_path.endswith('/') and url != '/' else url)
+        if found is not None: return found
+        if os.path.isfile(safe_path): return safe_path
+        if os.path.isdir(safe_path): return DIRECTORY
+        if not url_path.endswith('/') and os.path.isfile(safe_path + '.html'): return safe_path + '.html'
+        return None
+
+    def render_template_page(self, path=None):
+        # Страница из pages/ пересобирается, только если изменились её шаблоны
+        # (сверка по stat, см. build_pages.render_if_stale); результат живёт на диске и в static_cache
+        if path is None:
+            url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).strip('/') or 'index'
+            path = os.path.join(ROOT_DIR, url_path if url_path.endswith('.html') else url_path + '.html')
+        elif not path.endswith('.html'): return None
+        name = os.path.basename(path)
+        if os.path.dirname(path) != ROOT_DIR or not build_pages.has_source(name): return None
+        try: notify_change(*build_pages.render_if_stale(name, build_update('build')))
+        except build_pages.TemplateError as e:
+            sys.stderr.write(f"Template error: {e}\n")
+        return path if os.path.isfile(path) else None
+
+    def is_not_modified(self, entry, etag):
+        inm = self.headers.get('If-None-Match')
+        if inm:
+            tags = [t.strip() for t in inm.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        ims = self.headers.get('If-Modified-Since')
+        if ims:
+            try: return int(entry['mtime'] // 1_000_000_000) <= email.utils.parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError): pass
+        return False
+
+    def accepted_encoding(self):
+        return accepted_encoding(self.headers.get('Accept-Encoding', ''))
+
+    def is_fingerprinted(self, path, entry):
+        # Бандл build_css назван по содержимому; остальное — ?v= из fingerprint.py.
+        # Устаревший ?v= (страницу ещё не переписали) получает обычный Cache-Control
+        if build_css.BUNDLE_NAME.match(os.path.basename(path)): return True
+        version = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).get('v', [''])[0]
+        return bool(version) and version == static_cache.digest(path, entry)
+
+    def serve_static(self, path):
+        entry = (self.on_loop and static_cache.peek(path)) or static_cache.get(path)
+        if entry is None: self.send_error(404); return
+        body, etag = entry['body'], entry['etag']
+        cache_control = CACHE_CONTROL_IMMUTABLE if self.is_fingerprinted(path, entry) else entry['cache_control']
+        headers = {'Last-Modified': entry['last_modified'], 'Cache-Control': cache_control}
+        if entry['compressible']:
+            headers['Vary'] = 'Accept-Encoding'
+            # Диапазоны отдаём только от несжатого представления
+            encoding = self.accepted_encoding() if 'Range' not in self.headers else None
+            if encoding:
+                body, etag = static_cache.variant(path, entry, encoding)
+                headers['Content-Encoding'] = encoding
+        headers['ETag'] = etag
+        if self.is_not_modified(entry, etag):
+            self.send_response(304)
+            for k, v in headers.items():
+                if k != 'Content-Encoding': self.send_header(k, v)
+            self.end_headers()
+            return
+        if body is not None:
+            self.send_content(entry['ctype'], len(body), headers, body=body)
+            return
+        try: f = open(path, 'rb')
+        except OSError: self.send_error(404); return
+        with f: self.send_content(entry['ctype'], os.fstat(f.fileno()).st_size, headers, f=f)
+
+    def with_digest(self, item):
+        # Для медиатеки: хэш оригинала идёт в ?v= миниатюры (запомнен по mtime/size)
+        path = os.path.join(ROOT_DIR, item['path'])
+        if not thumbs.supports(path): return item
+        try: return dict(item, digest=thumbs.digest(path))
+        except OSError: return item
+
+    def serve_thumb(self, filename, width, version=None):
+        safe_path = self.get_safe_path(filename)
+        if not safe_path or not os.path.isfile(safe_path) or os.path.splitext(safe_path)[1].lower() not in IMAGE_EXT:
+            self.send_error(404)
+            return
+        try: size = thumbs.size(int(width or THUMB_SIZES[0]))
+        except ValueError: self.send_error(400); return
+        target = thumbs.get(safe_path, size) if thumbs.supports(safe_path) else None
+        entry = static_cache.get(target) if target else None
+        if entry is None or entry['body'] is None:
+            # Нет Pillow, SVG или генерация не успела — отдаём оригинал, редирект не кэшируется
+            url = '/' + urllib.parse.quote(os.path.relpath(safe_path, ROOT_DIR).replace('\\', '/'))
+            self.send_body(b'', 'text/plain', 307, headers={'Location': url, 'Cache-Control': 'no-store'})
+            return
+        # ?v=<хэш оригинала> меняется вместе с ним — такой URL можно кэшировать навсегда;
+        # устаревший или произвольный v получает перепроверяемый ответ
+        try: versioned = version is not None and version == thumbs.digest(safe_path)
+        except OSError: versioned = False
+        headers = {'ETag': entry['etag'], 'Cache-Control': THUMB_CACHE_CONTROL if versioned else 'private, no-cache'}
+        if self.is_not_modified(entry, entry['etag']):
+            self.send_response(304)
+            for k, v in headers.items(): self.send_header(k, v)
+            self.end_headers()
+            return
+        self.send_body(entry['body'], entry['ctype'], headers=headers)
+
+    def get_range(self, size, validators):
+        # None — отдать целиком, (start, end) — 206, False — 416
+        header = self.headers.get('Range', '').strip()
+        if not header.startswith('bytes=') or ',' in header: return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range.strip() not in validators: return None
+        start, _, end = header[6:].strip().partition('-')
+        try:
+            if not start:
+                n = int(end)
+                if n <= 0: return False
+                start, end = max(0, size - n), size - 1
+            else:
+                start, end = int(start), int(end) if end else size - 1
+        except ValueError: return None
+        if start >= size or end < start: return False
+        return start, min(end, size - 1)
+
+    def send_content(self, ctype, size, headers, body=None, f=None):
+        rng = self.get_range(size, (headers.get('ETag'), headers.get('Last-Modified')))
+        if rng is False:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = rng or (0, size - 1)
+        length = end - start + 1 if size else 0
+        self.send_response(206 if rng else 200)
+        self.send_header('Content-type', ctype)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if rng: self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        for k, v in headers.items(): self.send_header(k, v)
+        self.end_headers()
+        if self.command == 'HEAD' or not length: return
+        if body is not None: self.wfile.write(memoryview(body)[start:end + 1])
+        else: self.send_file_range(f, start, length)
+
+    def send_file_range(self, f, start, length):
+        # socket.sendfile использует os.sendfile (без копирования через Python),
+        # а где его нет — сам откатывается на чтение кусками и send()
+        self.connection.sendfile(f, start, length)
+
     # --- ФАЙЛОВЫЕ ОПЕРАЦИИ ---
 
     def get_safe_path(self, path):
         if not path: return None
         safe_path = os.path.normpath(os.path.join(ROOT_DIR, path.lstrip('/')))
         if not safe_path.startswith(ROOT_DIR): return None
-        if os.path.basename(safe_path) in EXCLUDE_FILES: return None
+        # Служебное не отдаём и внутри папок (.git/..., .build/history/...)
+        parts = os.path.relpath(safe_path, ROOT_DIR).split(os.sep)
+        if any(p in EXCLUDE_FILES for p in parts): return None
         return safe_path
 
     def get_file_tree(self, directory):
-        items = []
-        try:
-            for entry in os.scandir(directory):
-                if entry.name.startswith('.') or entry.name in EXCLUDE_FILES: continue
-
-                item = {
-                    'name': entry.name,
-                    'path': os.path.relpath(entry.path, ROOT_DIR).replace('\\', '/'),
-                    'type': 'folder' if entry.is_dir() else 'file'
-                }
-                if entry.is_dir():
-                    item['children'] = self.get_file_tree(entry.path)
-                elif os.path.splitext(entry.name)[1].lower() in ALLOWED_EXT:
-                    pass
-                else: continue
-                items.append(item)
-            return sorted(items, key=lambda x: (x['type'] != 'folder', x['name']))
-        except: return []
+        return file_index.tree(directory)
 
     def serve_file_content(self, filename):
         safe_path = self.get_safe_path(filename)
@@ -274,21 +1891,17 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
                 # Определяем, бинарный файл или текстовый
                 ext = os.path.splitext(safe_path)[1].lower()
                 if ext in IMAGE_EXT:
-                    with open(safe_path, 'rb') as f:
-                        content = f.read()
-                    self.send_response(200)
-                    # MIME types
-                    mime = mimetypes.guess_type(safe_path)[0] or 'application/octet-stream'
-                    self.send_header('Content-type', mime)
-                    self.end_headers()
-                    self.wfile.write(content)
+                    f = open(safe_path, 'rb')
+                    with f:
+                        st = os.fstat(f.fileno())
+                        # MIME types
+                        mime = mimetypes.guess_type(safe_path)[0] or 'application/octet-stream'
+                        headers = {'Last-Modified': email.utils.formatdate(st.st_mtime, usegmt=True), 'Cache-Control': 'no-store'}
+                        self.send_content(mime, st.st_size, headers, f=f)
                 else:
                     with open(safe_path, 'r', encoding='utf-8') as f:
                         content = f.read()
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(content.encode('utf-8'))
+                    self.send_body(content.encode('utf-8'), 'text/plain; charset=utf-8')
             except: self.send_error(500, "Read error")
         else: self.send_error(404)
 
@@ -296,11 +1909,46 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         safe_path = self.get_safe_path(filename)
         if safe_path:
             try:
-                with open(safe_path, 'w', encoding='utf-8') as f: f.write(content)
+                # Те же байты, что давала запись в текстовом режиме
+                history.write(safe_path, content.replace('\n', os.linesep).encode('utf-8'))
+                self.after_save(safe_path)
                 return True
             except: pass
         return False
 
+    def restore_version(self, filename, version):
+        safe_path = self.get_safe_path(filename)
+        if not safe_path or os.path.isdir(safe_path): return False
+        # Только версии этого файла: чужой объект по id не подставить
+        if version not in {e['id'] for e in history.list(safe_path)}: return False
+        data = history.get(version)
+        if data is None: return False
+        try:
+            os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+            history.write(safe_path, data, 'restore')
+            self.after_save(safe_path)
+            return True
+        except OSError: return False
+
+    def after_save(self, safe_path):
+        notify_change(safe_path)
+        warm_in_background([safe_path])
+        threading.Thread(target=run_builds, args=(safe_path,), daemon=True).start()
+
+    def serve_history(self, filename, version=None):
+        safe_path = self.get_safe_path(filename)
+        if not safe_path: self.send_api_response(False, message="Invalid path"); return
+        if not version:
+            self.send_api_response(True, {'file': history.rel(safe_path), 'versions': history.list(safe_path)})
+            return
+        # Только версии этого файла: чужой объект по id не прочитать
+        if version not in {e['id'] for e in history.list(safe_path)}: self.send_error(404); return
+        data = history.get(version)
+        if data is None: self.send_error(404); return
+        mime = mimetypes.guess_type(safe_path)[0] or 'application/octet-stream'
+        if os.path.splitext(safe_path)[1].lower() not in IMAGE_EXT: mime = 'text/plain; charset=utf-8'
+        self.send_body(data, mime, headers={'Cache-Control': 'no-store'})
+
     def create_fs_item(self, path, is_folder):
         safe_path = self.get_safe_path(path)
         if not safe_path or os.path.exists(safe_path): return False
@@ -309,6 +1957,7 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
             else:
                 os.makedirs(os.path.dirname(safe_path), exist_ok=True)
                 with open(safe_path, 'w', encoding='utf-8') as f: f.write("")
+            notify_change(safe_path)
             return True
         except: return False
 
@@ -316,29 +1965,89 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         safe_path = self.get_safe_path(path)
         if not safe_path: return False
         try:
-            if os.path.isdir(safe_path): shutil.rmtree(safe_path)
-            else: os.remove(safe_path)
+            # Удаляемое остаётся в истории — его можно восстановить
+            if os.path.isdir(safe_path):
+                for root, _, files in os.walk(safe_path):
+                    for name in files: history.snapshot(os.path.join(root, name), 'delete')
+                shutil.rmtree(safe_path)
+            else:
+                history.snapshot(safe_path, 'delete')
+                os.remove(safe_path)
+            notify_change(safe_path)
             return True
         except: return False
 
-    def rename_fs_item(self, old_path, new_name):
+    def rename_fs_item(self, old_path, new_name, update_refs=False):
+        # None — ошибка; иначе список страниц, где переписаны ссылки (update_refs)
         safe_old = self.get_safe_path(old_path)
-        if not safe_old or not os.path.exists(safe_old): return False
+        if not safe_old or not os.path.exists(safe_old) or not new_name: return None
         new_name = os.path.basename(new_name)
-        if not new_name or new_name in EXCLUDE_FILES: return False
+        if not new_name or new_name in EXCLUDE_FILES: return None
         safe_new = os.path.join(os.path.dirname(safe_old), new_name)
-        if os.path.exists(safe_new): return False
+        if os.path.exists(safe_new): return None
+        referrers = ref_graph.graph.referrers(safe_old) if update_refs else []
         try:
             os.rename(safe_old, safe_new)
-            return True
-        except: return False
+            fsync_dir(os.path.dirname(safe_new))
+            history.renamed(safe_old, safe_new)
+            thumbs.renamed(safe_old, safe_new)
+            notify_change(safe_old, safe_new)
+        except: return None
+        # Ссылающиеся страницы правятся одной пачкой, каждая правка — в истории
+        updated = ref_graph.graph.rewrite_referrers(safe_old, safe_new, referrers, build_update('refs'))
+        if updated:
+            notify_change(*updated)
+            threading.Thread(target=run_builds, args=updated, daemon=True).start()
+        return [os.path.relpath(p, ROOT_DIR).replace('\\', '/') for p in updated]
 
     def handle_upload(self):
-        import cgi
+        ctype = self.headers.get('Content-Type', '')
+        m = re.search(r'boundary="?([^";]+)"?', ctype)
+        try: length = int(self.headers.get('Content-Length', 0))
+        except ValueError: length = 0
+        if not ctype.startswith('multipart/form-data') or not m or length <= 0:
+            self.close_connection = True
+            self.send_api_response(False, message="Bad upload request")
+            return
+        if length > MAX_UPLOAD_SIZE:
+            # Тело не читаем — соединение после ответа закрывается
+            self.close_connection = True
+            self.send_api_response(False, message="Upload too large")
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        upload_path = query.get('path', [None])[0]
+        pending = []  # (tmp_path, filename, oid, size)
+        obj = None
         try:
-            form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD': 'POST'})
-            upload_path = form.getvalue('path', '')
-            fileitem = form['file']
+            for name, filename, chunks in iter_multipart(self.rfile, m.group(1).encode(), length):
+                if filename is None:
+                    value = b''.join(chunks)
+                    if name == 'path' and upload_path is None: upload_path = value.decode('utf-8')
+                    continue
+                fn = os.path.basename(filename.replace('\\', '/'))
+                if not fn: continue
+                # Пишем сразу во временный файл в целевой папке (если она уже известна),
+                # чтобы перенос на место был атомарным os.replace
+                tmp_dir = self.get_safe_path(upload_path or 'resources')
+                if not tmp_dir or not os.path.isdir(tmp_dir): tmp_dir = ROOT_DIR
+                fd, tmp = tempfile.mkstemp(prefix='.upload-', dir=tmp_dir)
+                pending.append([tmp, fn, None, 0])
+                # Объект для истории считается тут же, из тех же кусков
+                obj = history.stream()
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        obj.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp, 0o644)
+                pending[-1][2:] = obj.close(), obj.size
+                obj = None
+
+            if not pending:
+                self.send_api_response(False, message="No file")
+                return
 
             # Если путь пустой или корень, принудительно используем 'resources'
             if not upload_path or upload_path == '.' or upload_path == '/':
@@ -346,32 +2055,44 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
 
             # Создаем папку resources если её нет
             safe_dir = self.get_safe_path(upload_path)
-            if safe_dir and not os.path.exists(safe_dir):
-                os.makedirs(safe_dir)
-
-            if fileitem.filename:
-                fn = os.path.basename(fileitem.filename)
-                target_path = os.path.join(upload_path, fn)
-                safe_path = self.get_safe_path(target_path)
-                if safe_path:
-                    with open(safe_path, 'wb') as f: f.write(fileitem.file.read())
-                    self.send_api_response(True)
-                else: self.send_api_response(False, message="Invalid path")
-            else: self.send_api_response(False, message="No file")
-        except Exception as e: self.send_api_response(False, message=str(e))
+            if not safe_dir:
+                self.send_api_response(False, message="Invalid path")
+                return
+            os.makedirs(safe_dir, exist_ok=True)
+
+            saved = []
+            for tmp, fn, oid, size in pending:
+                safe_path = self.get_safe_path(os.path.join(upload_path, fn))
+                if not safe_path: continue
+                # Заменяемый файл сохраняем в историю, новый — тоже (объект уже записан)
+                with history.path_lock(safe_path):
+                    if os.path.isfile(safe_path) and not history.list(safe_path):
+                        history.snapshot(safe_path, 'original')
+                    os.replace(tmp, safe_path)
+                    if oid: history.add(safe_path, oid, size, 'upload')
+                notify_change(safe_path)
+                thumbs.prefetch(safe_path)
+                saved.append(os.path.relpath(safe_path, ROOT_DIR).replace('\\', '/'))
+            fsync_dir(safe_dir)
+            if saved:
+                # Заменённая картинка получает новый ?v= на страницах
+                threading.Thread(target=run_builds, args=[os.path.join(ROOT_DIR, p) for p in saved], daemon=True).start()
+                self.send_api_response(True, {'files': saved})
+            else: self.send_api_response(False, message="Invalid path")
+        except Exception as e:
+            self.close_connection = True
+            self.send_api_response(False, message=str(e))
+        finally:
+            if obj: obj.discard()
+            for tmp, *_ in pending:
+                if os.path.exists(tmp): os.remove(tmp)
 
     # --- UI ---
     def serve_login(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
         html = """<!DOCTYPE html><html><head><title>Login</title><meta name="viewport" content="width=device-width, initial-scale=1"><style>body{background:#f0f2f5;font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,sans-serif;display:flex;height:100vh;align-items:center;justify-content:center;margin:0}form{background:#fff;padding:40px;border-radius:12px;box-shadow:0 2px 15px rgba(0,0,0,0.1);width:320px}h2{margin:0 0 20px;text-align:center;color:#1a1a1a}input{width:100%;padding:12px;margin-bottom:15px;border:1px solid #ddd;border-radius:6px;box-sizing:border-box}button{width:100%;padding:12px;background:#007aff;color:#fff;border:none;border-radius:6px;font-weight:600;cursor:pointer}button:hover{background:#0062cc}#msg{color:red;text-align:center;margin-bottom:10px;font-size:14px;min-height:20px}</style></head><body><form onsubmit="event.preventDefault(); login()"><h2>NanoCMS Ultimate</h2><div id="msg"></div><input type="password" id="pass" placeholder="Password" autofocus required><button type="submit">Sign In</button></form><script>async function login(){let p=document.getElementById('pass').value;let m=document.getElementById('msg');m.innerText='Checking...';try{let r=await fetch('/login',{method:'POST',body:JSON.stringify({password:p})});let d=await r.json();if(d.status==='success')location.reload();else m.innerText=d.message||'Error';}catch(e){m.innerText='Connection error'}}</script></body></html>"""
-        self.wfile.write(html.encode('utf-8'))
+        self.send_body(html.encode('utf-8'), 'text/html; charset=utf-8')
 
     def serve_ui(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
         html = r"""
 <!DOCTYPE html>
 <html lang="en">
@@ -389,7 +2110,14 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         .sb-tools { padding: 8px; display: flex; gap: 5px; border-bottom: 1px solid var(--border); }
         .tool-btn { border: none; background: transparent; cursor: pointer; padding: 6px; border-radius: 4px; color: #6c757d; }
         .tool-btn:hover { background: #e9ecef; color: var(--text); }
-        #tree { flex: 1; overflow-y: auto; padding: 10px 0; }
+        #tree, #search-results { flex: 1; overflow-y: auto; padding: 10px 0; }
+        .sb-search { padding: 8px; border-bottom: 1px solid var(--border); }
+        .sb-search input { width: 100%; padding: 6px 8px; border: 1px solid #ced4da; border-radius: 4px; box-sizing: border-box; font-size: 13px; }
+        .s-item { padding: 8px 15px; cursor: pointer; font-size: 13px; border-bottom: 1px solid var(--border); }
+        .s-item:hover { background: #f1f3f5; }
+        .s-item b { display: block; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+        .s-item small { color: #6c757d; }
+        .s-item mark { background: #fff3bf; padding: 0; }
         .t-item { padding: 6px 15px; cursor: pointer; display: flex; align-items: center; font-size: 14px; white-space: nowrap; overflow: hidden; user-select: none; }
         .t-item:hover { background: #f1f3f5; }
         .t-item.active { background: #e7f1ff; color: var(--accent); }
@@ -440,6 +2168,8 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         <div style="flex:1"></div>
         <button class="tool-btn" onclick="location.href='/logout'" title="Logout"><i class="fas fa-sign-out-alt"></i></button>
     </div>
+    <div class="sb-search"><input type="search" id="search-input" placeholder="Search pages..." oninput="searchPages(this.value)"></div>
+    <div id="search-results" style="display:none"></div>
     <div id="tree">Loading...</div>
 </div>
 
@@ -451,6 +2181,7 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
                 <button class="tool-btn" id="btn-code" onclick="setMode('code')">Code</button>
                 <button class="tool-btn" id="btn-vis" onclick="setMode('visual')">Visual</button>
             </div>
+            <button class="tool-btn" id="btn-history" onclick="showHistory()" disabled>History</button>
             <button class="btn" id="btn-save" onclick="saveCurrent()" disabled>Save (Ctrl+S)</button>
         </div>
     </div>
@@ -540,11 +2271,33 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         else { currentFile=null; document.getElementById('current-path').innerText=path; }
     }
 
+    // --- SEARCH ---
+    let searchTimer = null;
+    function searchPages(q){
+        clearTimeout(searchTimer);
+        let box=document.getElementById('search-results'); let tree=document.getElementById('tree');
+        if(!q.trim()){ box.style.display='none'; tree.style.display='block'; return; }
+        searchTimer=setTimeout(async()=>{
+            let r=await fetch('/api/search?q='+encodeURIComponent(q)); let j=await r.json();
+            if(document.getElementById('search-input').value!==q) return;
+            let d=j.data||{results:[],total:0};
+            // Сниппет приходит уже экранированным, с <mark> вокруг найденных слов
+            let h=`<div class="s-item"><small>${d.total} pages</small></div>`;
+            d.results.forEach(x=>{ h+=`<div class="s-item" data-path="${x.file}" onclick="openResult(this.dataset.path)"><b>${x.file}</b><small>${x.snippet}</small></div>`; });
+            box.innerHTML=h; box.style.display='block'; tree.style.display='none';
+        },200);
+    }
+    async function openResult(path){
+        await loadFile(path);
+        let q=document.getElementById('search-input').value.replace(/"/g,'').trim();
+        if(q) editor.find(q.split(/\s+/)[0],{wrap:true,caseSensitive:false});
+    }
+
     // --- EDITOR ---
     async function loadFile(path){
         if(currentFile===path)return;
         currentFile=path; document.getElementById('current-path').innerText=path;
-        document.getElementById('btn-save').disabled=true;
+        document.getElementById('btn-save').disabled=true; document.getElementById('btn-history').disabled=true;
         let ext=path.split('.').pop().toLowerCase();
         let isVis=['html','htm','php'].includes(ext);
         document.getElementById('mode-switch').style.display=isVis?'block':'none';
@@ -555,7 +2308,7 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
             let m='ace/mode/text';
             if(ext==='js')m='ace/mode/javascript'; if(ext==='css')m='ace/mode/css'; if(ext==='php')m='ace/mode/php'; if(isVis)m='ace/mode/html';
             editor.session.setMode(m);
-            document.getElementById('btn-save').disabled=false;
+            document.getElementById('btn-save').disabled=false; document.getElementById('btn-history').disabled=false;
         }
     }
     function setMode(m, force){
@@ -630,6 +2383,17 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
         if(r.status==='success') showToast('Saved!'); else showToast('Error: '+r.message);
     }
 
+    async function showHistory(){
+        if(!currentFile)return;
+        let r=await fetch('/api/history?file='+encodeURIComponent(currentFile)); let j=await r.json();
+        let v=(j.data&&j.data.versions)||[];
+        if(!v.length){ showToast('No history yet'); return; }
+        let list=v.slice(0,20).map((e,i)=>`${i+1}. ${new Date(e.time*1000).toLocaleString()} — ${e.action}, ${e.size} B`).join('\n');
+        let n=parseInt(prompt('Restore which version?\n'+list,'1')); if(!n||!v[n-1])return;
+        let res=await api('restore',{file:currentFile,version:v[n-1].id});
+        if(res.status==='success'){ let f=currentFile; currentFile=null; loadFile(f); showToast('Restored'); } else showToast('Error: '+res.message);
+    }
+
     // --- IMAGE MODAL LOGIC ---
     let editingImgId = null;
     window.addEventListener('message', e=>{
@@ -649,20 +2413,17 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
     function closeImgModal() { document.getElementById('img-modal-wrap').style.display='none'; }
 
     async function loadGallery() {
-        // Flatten tree to find images
+        // Server-side filtered list instead of flattening the whole tree
         let images = [];
-        function find(items) {
-            items.forEach(i=>{
-                if(i.type==='file' && i.name.match(/\.(jpg|png|gif|svg|webp|jpeg)$/i)) images.push(i);
-                if(i.children) find(i.children);
-            });
-        }
-        find(treeData);
+        let r = await fetch('/api/list?filter=images'); let j = await r.json();
+        if(j.status==='success') images = j.data.items;
 
         let html = '';
         images.forEach(img => {
+            // Миниатюра вместо оригинала; v — хэш файла, так что браузер её кэширует
+            let thumb = `/api/thumb?file=${encodeURIComponent(img.path)}&w=120` + (img.digest ? `&v=${img.digest}` : '');
             html += `<div class="img-card" onclick="selectImg('${img.path}')">
-                <img src="${img.path}">
+                <img src="${thumb}" loading="lazy">
                 <span>${img.name}</span>
             </div>`;
         });
@@ -696,8 +2457,8 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
     async function handleImgUpload(files) {
         if(!files.length) return;
         let fd = new FormData();
-        fd.append('file', files[0]);
         fd.append('path', 'resources'); // Force resources for this specific modal
+        fd.append('file', files[0]);
 
         let r = await fetch('/api/upload', {method:'POST', body: fd});
         let j = await r.json();
@@ -734,14 +2495,28 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
     // --- CTX & DND ---
     function openCtx(e,p,t,n){ e.preventDefault();e.stopPropagation(); currentCtxItem={path:p,type:t,name:n}; let m=document.getElementById('ctx-menu'); m.style.display='flex'; m.style.top=e.clientY+'px'; m.style.left=e.clientX+'px'; }
     document.addEventListener('click',()=>document.getElementById('ctx-menu').style.display='none');
-    function ctxDelete(){
-        if(!currentCtxItem)return; if(confirm(`Delete ${currentCtxItem.name}?`)){
+    async function referrersOf(path){
+        // Страницы, ссылающиеся на path (кроме него самого)
+        let r=await fetch('/api/refs?file='+encodeURIComponent(path)); let j=await r.json();
+        return j.status==='success'?j.data.referrers.filter(p=>p!==path):[];
+    }
+    async function ctxDelete(){
+        if(!currentCtxItem)return;
+        let refs=await referrersOf(currentCtxItem.path);
+        let warn=refs.length?`\n\nLinks in ${refs.length} page(s) will break: ${refs.slice(0,5).join(', ')}${refs.length>5?', ...':''}`:'';
+        if(confirm(`Delete ${currentCtxItem.name}?${warn}`)){
             api('delete',{path:currentCtxItem.path}).then(r=>{if(r.status==='success'){if(currentFile===currentCtxItem.path){currentFile=null;editor.setValue('');}refreshTree();}else showToast(r.message);});
         }
     }
-    function ctxRename(){
+    async function ctxRename(){
         if(!currentCtxItem)return; let n=prompt("New name:",currentCtxItem.name);
-        if(n&&n!==currentCtxItem.name) api('rename',{old_path:currentCtxItem.path,new_name:n}).then(r=>{if(r.status==='success')refreshTree();else showToast(r.message);});
+        if(!n||n===currentCtxItem.name) return;
+        let refs=await referrersOf(currentCtxItem.path);
+        let upd=refs.length>0&&confirm(`Update links in ${refs.length} page(s) that reference ${currentCtxItem.name}?`);
+        api('rename',{old_path:currentCtxItem.path,new_name:n,update_refs:upd}).then(r=>{
+            if(r.status==='success'){ refreshTree(); if(r.data&&r.data.updated) showToast(`Links updated in ${r.data.updated.length} page(s)`); }
+            else showToast(r.message);
+        });
     }
     function showDrop(e){e.preventDefault();document.getElementById('drop-zone').style.display='flex';}
     function hideDrop(e){e.preventDefault();document.getElementById('drop-zone').style.display='none';}
@@ -751,11 +2526,11 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
     }
     async function uploadFiles(files){
         let tp=''; if(currentCtxItem&&currentCtxItem.type==='folder') tp=currentCtxItem.path;
-        for(let i=0;i<files.length;i++){
-            let fd=new FormData(); fd.append('file',files[i]); fd.append('path',tp);
-            await fetch('/api/upload',{method:'POST',body:fd});
-        }
-        refreshTree(); showToast('Upload finished');
+        // One request for all files; path goes first so the server can stream straight into the folder
+        let fd=new FormData(); fd.append('path',tp);
+        for(let i=0;i<files.length;i++) fd.append('file',files[i]);
+        let r=await fetch('/api/upload',{method:'POST',body:fd}); let j=await r.json();
+        refreshTree(); showToast(j.status==='success'?'Upload finished':'Upload failed: '+j.message);
     }
     function showToast(m){let t=document.getElementById('toast');t.innerText=m;t.style.display='block';setTimeout(()=>t.style.display='none',3000);}
     document.addEventListener('keydown',e=>{if((e.ctrlKey||e.metaKey)&&e.key==='s'){e.preventDefault();saveCurrent();}});
@@ -764,11 +2539,294 @@ class CMSHandler(http.server.SimpleHTTPRequestHandler):
 </body>
 </html>
         """
-        self.wfile.write(html.encode('utf-8'))
+        self.send_body(html.encode('utf-8'), 'text/html; charset=utf-8')
+
+# --- СЕРВЕР ---
+class PooledHTTPServer(socketserver.TCPServer):
+    # Фиксированный пул потоков + ограниченная очередь соединений.
+    # Если очередь заполнена, клиент сразу получает 503, а не висит в accept.
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=WORKERS, backlog=BACKLOG, queue_size=QUEUE_SIZE, sock=None):
+        self.request_queue_size = backlog
+        self.pending = queue.Queue(queue_size)
+        self.stopping = False
+        self.threads = []
+        if sock is None:
+            super().__init__(server_address, handler_class)
+        else:
+            # Слушающий сокет унаследован от мастера (--processes)
+            super().__init__(server_address, handler_class, bind_and_activate=False)
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        for i in range(workers):
+            t = threading.Thread(target=self.worker_loop, name=f'cms-worker-{i}', daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def worker_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None: return
+            request, client_address = item
+            try: self.finish_request(request, client_address)
+            except Exception: self.handle_error(request, client_address)
+            finally: self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        try: self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            metrics.reject()
+            try: request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n')
+            except OSError: pass
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # Новые соединения уже не принимаются; дорабатываем очередь и гасим потоки
+        self.stopping = True
+        super().server_close()
+        for _ in self.threads: self.pending.put(None)
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for t in self.threads: t.join(max(0, deadline - time.time()))
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description='NanoCMS server')
+    p.add_argument('--port', type=int, default=PORT)
+    p.add_argument('--bind', default='')
+    p.add_argument('--workers', type=int, default=WORKERS)
+    p.add_argument('--backlog', type=int, default=BACKLOG)
+    p.add_argument('--queue', type=int, default=QUEUE_SIZE)
+    p.add_argument('--no-precompress', action='store_true', help='не сжимать страницы при старте')
+    p.add_argument('--render-templates', action='store_true', help='собирать страницы из pages/ при запросе')
+    p.add_argument('--async', dest='use_async', action='store_true', help='ядро на asyncio вместо пула потоков')
+    p.add_argument('--processes', type=int, default=PROCESSES, help='число процессов-воркеров на одном сокете (только POSIX)')
+    p.add_argument('--state-db', default=STATE_DB, metavar='FILE', help='SQLite-файл сессий и блокировок входа (общий для процессов)')
+    p.add_argument('--access-log', default=ACCESS_LOG, metavar='FILE', help='JSON-журнал запросов')
+    return p.parse_args(argv)
+
+# --- ASYNCIO ---
+# Альтернативное ядро (--async): соединения обслуживает один цикл событий,
+# простаивающий keep-alive не занимает поток. Маршруты — те же методы
+# CMSHandler: запрос передаётся ему из буфера, ответ собирается в буфер.
+# В самом цикле отвечаем только на GET статики, которая уже лежит в кэше
+# (свежая и сжатая под клиента); всё, что может ждать диск, сжатие, SQLite
+# или хэш пароля, — в пуле потоков. Большие файлы уходят через loop.sendfile.
+
+ASYNC_SPOOL_SIZE = 1024 * 1024  # тело запроса больше этого уходит во временный файл
+
+class BufferedHandler(CMSHandler):
+    def __init__(self, rfile, client_address, server):
+        # BaseRequestHandler.__init__ не вызываем: сокета нет
+        self.rfile = rfile
+        self.wfile = io.BytesIO()
+        self.client_address = client_address
+        self.server = server
+        self.directory = ROOT_DIR
+        self.connection = None
+        self.stream = None  # (file, offset, length) — досылается после заголовков
+        self.close_connection = True
+
+    def send_file_range(self, f, start, length):
+        # Файл закроется вместе с serve_static, поэтому берём свою копию дескриптора
+        self.stream = (os.fdopen(os.dup(f.fileno()), 'rb'), start, length)
+
+class AsyncServer:
+    def __init__(self, args, sock=None):
+        self.args = args
+        self.sock = sock
+        self.stopping = False
+        self.pool = ThreadPoolExecutor(args.workers, thread_name_prefix='cms-async')
+
+    def in_memory(self, head):
+        # True, если ответ целиком готов в памяти: файл в таблице маршрутов,
+        # запись кэша недавно сверена с диском, нужная сжатая версия уже есть
+        line, _, rest = head.partition(b'\r\n')
+        method, _, target = line.partition(b' ')
+        if method not in (b'GET', b'HEAD') or RENDER_TEMPLATES: return False
+        path = target.split(b' ', 1)[0].split(b'?', 1)[0].split(b'#', 1)[0].decode('latin-1')
+        if path.startswith('/api/') or path in ('/logout', '/admin', '/admin/'): return False
+        found = route_table.peek(path)
+        entry = static_cache.peek(found) if isinstance(found, str) else None
+        if entry is None or entry['body'] is None: return False
+        if not entry['compressible']: return True
+        headers = http.client.parse_headers(io.BytesIO(rest))
+        encoding = accepted_encoding(headers.get('Accept-Encoding', '')) if 'Range' not in headers else None
+        return encoding is None or encoding in entry['variants']
+
+    async def read_request(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+        m = re.search(rb'(?im)^content-length:\s*(\d+)\s*$', head)
+        length = int(m.group(1)) if m else 0
+        rfile = tempfile.SpooledTemporaryFile(ASYNC_SPOOL_SIZE)
+        rfile.write(head)
+        # Слишком большое тело не читаем: обработчик ответит ошибкой, соединение закроется
+        too_large = length > MAX_UPLOAD_SIZE
+        left = 0 if too_large else length
+        while left > 0:
+            # Как таймаут сокета у потокового сервера: каждый кусок тела ждём не дольше KEEPALIVE_TIMEOUT
+            chunk = await asyncio.wait_for(reader.read(min(UPLOAD_CHUNK, left)), KEEPALIVE_TIMEOUT)
+            if not chunk: raise asyncio.IncompleteReadError(b'', left)
+            rfile.write(chunk)
+            left -= len(chunk)
+        rfile.seek(0)
+        return rfile, head, too_large
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')[:2]
+        try:
+            while not self.stopping:
+                try: rfile, head, too_large = await self.read_request(reader)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    break
+                with rfile:
+                    handler = BufferedHandler(rfile, peer, self)
+                    if self.in_memory(head):
+                        handler.on_loop = True
+                        handler.handle_one_request()
+                    else: await loop.run_in_executor(self.pool, handler.handle_one_request)
+                writer.write(handler.wfile.getvalue())
+                if handler.stream:
+                    f, start, length = handler.stream
+                    with f: await loop.sendfile(writer.transport, f, start, length)
+                await writer.drain()
+                if handler.close_connection or too_large: break
+        except (ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            pass  # остановка: asyncio.run отменяет простаивающие keep-alive соединения
+        finally:
+            writer.close()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try: loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError): pass  # Windows: остаётся KeyboardInterrupt
+        if self.sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=self.sock)
+        else:
+            server = await asyncio.start_server(self.handle_connection, self.args.bind or None, self.args.port,
+                                                backlog=self.args.backlog, reuse_address=True)
+        async with server:
+            await stop.wait()
+            # Новые соединения не принимаем; keep-alive закрываются после текущего запроса
+            self.stopping = True
+            server.close()
+            try: await asyncio.wait_for(server.wait_closed(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError: pass
+        self.pool.shutdown(wait=False)
+
+def serve(args, sock=None):
+    # Один процесс: пул потоков (или цикл asyncio) на слушающем сокете (своём или от мастера)
+    if not args.no_precompress: warm_in_background(iter_site_files(COMPRESS_EXT))
+    threading.Thread(target=sync_indexes, daemon=True).start()
+    access_log.start(args.access_log)
+    if args.state_db: security.use_state_db(args.state_db)
+    security.start_sweeper()
+    if args.use_async:
+        try: asyncio.run(AsyncServer(args, sock).run())
+        except KeyboardInterrupt: pass
+        access_log.close()
+        return
+    with PooledHTTPServer((args.bind, args.port), CMSHandler, args.workers, args.backlog, args.queue, sock) as httpd:
+        # shutdown() блокируется до выхода из serve_forever, поэтому из обработчика сигнала — в отдельном потоке
+        signal.signal(signal.SIGTERM, lambda *a: threading.Thread(target=httpd.shutdown).start())
+        try: httpd.serve_forever()
+        except KeyboardInterrupt: pass
+    access_log.close()
+
+class Prefork:
+    # Мастер --processes: держит слушающий сокет, запускает воркеры через fork,
+    # перезапускает упавшие; SIGHUP — плавная замена всех воркеров новыми.
+    # Общее состояние: сессии и блокировки в --state-db, nanocms.json и журнал
+    # истории перечитываются по изменению, кэш статики и индекс файлов
+    # проверяют mtime сами. Метрики у каждого процесса свои.
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}  # pid -> поколение
+        self.generation = 0
+        self.crashes = []
+        self.stopping = False
+        self.reloading = False
+
+    def listen(self):
+        sock = socket.create_server((self.args.bind, self.args.port), backlog=self.args.backlog)
+        # Сокет общий: соединение забирает один воркер, остальные не должны зависнуть в accept()
+        sock.setblocking(False)
+        return sock
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                serve(self.args, self.sock)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = self.generation
+
+    def reap(self):
+        while self.workers:
+            try: pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError: return
+            if pid == 0: return
+            generation = self.workers.pop(pid, None)
+            if generation != self.generation or self.stopping: continue
+            # Воркер текущего поколения завершился сам — заменяем, но не чаще,
+            # чем раз в секунду, если он падает сразу после старта
+            sys.stderr.write(f"Worker {pid} exited with status {status}, restarting\n")
+            now = time.time()
+            self.crashes = [t for t in self.crashes if now - t < 10] + [now]
+            if len(self.crashes) > self.args.processes: time.sleep(1)
+            self.spawn()
+
+    def stop_workers(self, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try: os.kill(pid, sig)
+            except ProcessLookupError: pass
+
+    def run(self):
+        self.sock = self.listen()
+        signal.signal(signal.SIGTERM, lambda *a: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda *a: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGHUP, lambda *a: setattr(self, 'reloading', True))
+        for _ in range(self.args.processes): self.spawn()
+        while not self.stopping:
+            if self.reloading:
+                # Сначала новые воркеры, потом старые дорабатывают очередь и выходят
+                self.reloading = False
+                self.generation += 1
+                old = list(self.workers)
+                for _ in range(self.args.processes): self.spawn()
+                self.stop_workers(old)
+            self.reap()
+            time.sleep(0.2)
+        self.stop_workers(list(self.workers))
+        deadline = time.time() + SHUTDOWN_TIMEOUT + 5
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.stop_workers(list(self.workers), signal.SIGKILL)
+        self.sock.close()
 
 if __name__ == "__main__":
+    args = parse_args()
+    RENDER_TEMPLATES = args.render_templates
     os.chdir(ROOT_DIR)
     if not os.path.exists(CONFIG_FILE): security.load_config()
-    with socketserver.TCPServer(("", PORT), CMSHandler) as httpd:
-        try: httpd.serve_forever()
-        except KeyboardInterrupt: pass
\ No newline at end of file
+    security.calibrate()
+    if args.processes > 1 and hasattr(os, 'fork'):
+        if not args.state_db:
+            args.state_db = os.path.join(ROOT_DIR, '.build', 'state.db')
+            os.makedirs(os.path.dirname(args.state_db), exist_ok=True)
+        Prefork(args).run()
+    else:
+        serve(args)
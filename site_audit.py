@@ -0,0 +1,228 @@
+
+import os
+import re
+import json
+import codecs
+import hashlib
+import argparse
+import urllib.parse
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXCLUDE_DIRS = ["old_pages", "components", "resources", "templates", "pages"]
+CACHE_FILE = os.path.join(".build", "audit.json")  # относительно корня сайта
+CACHE_VERSION = 1
+
+OLD_DOMAIN = re.compile(r'^https?://fairfaxcoinandbullionexchange\.com', re.IGNORECASE)
+EXTERNAL = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//|#)', re.IGNORECASE)
+MIN_IMAGES = 2
+MAX_ASSET_SIZE = 500 * 1024
+CHUNK = 64 * 1024
+
+# --- РАЗБОР СТРАНИЦЫ ---
+# Страница читается кусками и проходит через потоковый токенизатор один раз;
+# из неё собираются только факты, а проверки работают уже по фактам.
+
+class PageScanner(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.facts = {'tags': [], 'ids': [], 'images': [], 'links': [], 'assets': []}
+        self.tags = set()
+        self.ids = set()
+
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        line = self.getpos()[0]
+        self.tags.add(tag)
+        if a.get('id'): self.ids.add(a['id'])
+        if tag == 'img':
+            self.facts['images'].append({'src': a.get('src') or '', 'alt': a.get('alt'), 'line': line})
+        elif tag == 'a' and a.get('href'):
+            self.facts['links'].append({'href': a['href'], 'line': line})
+        elif tag == 'script' and a.get('src'):
+            self.facts['assets'].append({'url': a['src'], 'line': line})
+        elif tag == 'link' and a.get('href') and 'stylesheet' in (a.get('rel') or ''):
+            self.facts['assets'].append({'url': a['href'], 'line': line})
+
+    handle_startendtag = handle_starttag
+
+    def result(self):
+        self.facts['tags'] = sorted(self.tags)
+        self.facts['ids'] = sorted(self.ids)
+        return self.facts
+
+def scan_page(path):
+    # Выполняется в пуле процессов: хэш и факты за один проход по файлу
+    h = hashlib.sha1()
+    scanner = PageScanner()
+    with open(path, 'rb') as f:
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            h.update(chunk)
+            scanner.feed(decoder.decode(chunk))
+        scanner.feed(decoder.decode(b'', final=True))
+    scanner.close()
+    return path, h.hexdigest(), scanner.result()
+
+# --- ПРОВЕРКИ ---
+# Каждая проверка: (rel_path, facts, site) -> список (line, message)
+
+CHECKS = {}
+
+def check(name):
+    def register(fn):
+        CHECKS[name] = fn
+        return fn
+    return register
+
+@check('missing-footer')
+def check_footer(page, facts, site):
+    return [] if 'footer' in facts['tags'] else [(None, "no <footer>")]
+
+@check('missing-menu')
+def check_menu(page, facts, site):
+    return [] if 'mobile-menu' in facts['ids'] else [(None, 'no id="mobile-menu"')]
+
+@check('few-images')
+def check_image_count(page, facts, site):
+    n = len(facts['images'])
+    return [(None, f"{n} images")] if n < MIN_IMAGES else []
+
+@check('old-domain-images')
+def check_old_domain(page, facts, site):
+    return [(i['line'], i['src']) for i in facts['images'] if OLD_DOMAIN.match(i['src'])]
+
+@check('missing-alt')
+def check_alt(page, facts, site):
+    return [(i['line'], i['src']) for i in facts['images'] if not (i['alt'] or '').strip()]
+
+@check('broken-links')
+def check_links(page, facts, site):
+    urls = [(l['line'], l['href']) for l in facts['links']]
+    urls += [(i['line'], i['src']) for i in facts['images']]
+    urls += [(a['line'], a['url']) for a in facts['assets']]
+    return [(line, url) for line, url in urls if not EXTERNAL.match(url) and site.resolve(page, url) is None]
+
+@check('oversized-assets')
+def check_sizes(page, facts, site):
+    issues = []
+    for line, url in [(i['line'], i['src']) for i in facts['images']] + [(a['line'], a['url']) for a in facts['assets']]:
+        if EXTERNAL.match(url): continue
+        path = site.resolve(page, url)
+        size = site.size(path) if path else 0
+        if size > MAX_ASSET_SIZE: issues.append((line, f"{url} ({size // 1024} KB)"))
+    return issues
+
+class Site:
+    def __init__(self, root):
+        self.root = root
+        self.sizes = {}
+
+    def resolve(self, page, url):
+        # Локальный URL -> путь к файлу; чистые URL (coins -> coins.html) поддерживаются
+        path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+        if not path: return os.path.join(self.root, page)
+        base = self.root if path.startswith('/') else os.path.dirname(os.path.join(self.root, page))
+        target = os.path.normpath(os.path.join(base, path.lstrip('/')))
+        for candidate in (target, target + '.html', os.path.join(target, 'index.html')):
+            if os.path.isfile(candidate): return candidate
+        return None
+
+    def size(self, path):
+        if path not in self.sizes: self.sizes[path] = os.path.getsize(path)
+        return self.sizes[path]
+
+# --- КЭШ И ЗАПУСК ---
+
+def load_cache(root):
+    try:
+        with open(os.path.join(root, CACHE_FILE), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if cache.get('version') == CACHE_VERSION else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(root, cache):
+    path = os.path.join(root, CACHE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(path + '.tmp', path)
+
+def list_pages(root):
+    pages = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith('.')]
+        for file in files:
+            if file.endswith(".html"):
+                pages.append(os.path.join(dirpath, file))
+    return sorted(pages)
+
+def collect_facts(root, workers=None, use_cache=True):
+    # Неизменённые файлы (mtime+size) берутся из кэша без чтения;
+    # изменённые разбираются в пуле процессов, факты кэшируются по хэшу содержимого
+    cache = load_cache(root) if use_cache else {}
+    files, by_hash = cache.get('files', {}), cache.get('facts', {})
+    facts, todo = {}, []
+    for path in list_pages(root):
+        rel = os.path.relpath(path, root).replace('\\', '/')
+        st = os.stat(path)
+        known = files.get(rel)
+        if known and known['mtime'] == st.st_mtime_ns and known['size'] == st.st_size and known['hash'] in by_hash:
+            facts[rel] = by_hash[known['hash']]
+        else:
+            todo.append(path)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, digest, page_facts in pool.map(scan_page, todo, chunksize=4):
+                rel = os.path.relpath(path, root).replace('\\', '/')
+                st = os.stat(path)
+                files[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'hash': digest}
+                by_hash[digest] = page_facts
+                facts[rel] = page_facts
+    if use_cache:
+        live = {files[rel]['hash'] for rel in facts if rel in files}
+        save_cache(root, {'version': CACHE_VERSION,
+                    'files': {rel: v for rel, v in files.items() if rel in facts},
+                    'facts': {h: v for h, v in by_hash.items() if h in live}})
+    return facts, len(todo)
+
+def audit(root=ROOT_DIR, checks=None, workers=None, use_cache=True):
+    facts, parsed = collect_facts(root, workers, use_cache)
+    site = Site(root)
+    report = {}
+    for name in (checks or CHECKS):
+        issues = []
+        for page in sorted(facts):
+            for line, message in CHECKS[name](page, facts[page], site):
+                issues.append({'file': page, 'line': line, 'message': message})
+        report[name] = issues
+    return report, {'pages': len(facts), 'parsed': parsed}
+
+def print_report(report):
+    for name, issues in report.items():
+        print(f"=== {name} ({len(issues)}) ===")
+        for i in issues:
+            where = f"{i['file']}:{i['line']}" if i['line'] else i['file']
+            print(f"{where}: {i['message']}")
+        print()
+
+def main(default_checks=None):
+    parser = argparse.ArgumentParser(description="Audit site pages in one parallel pass")
+    parser.add_argument("--root", default=ROOT_DIR)
+    parser.add_argument("--check", action="append", choices=sorted(CHECKS), help="run only these checks")
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    report, stats = audit(os.path.abspath(args.root), args.check or default_checks, args.workers, not args.no_cache)
+    if args.json:
+        print(json.dumps({'stats': stats, 'checks': report}, indent=2))
+    else:
+        print_report(report)
+        print(f"{stats['pages']} pages, {stats['parsed']} parsed, {stats['pages'] - stats['parsed']} from cache")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch_assets
+
+BODY = bytes(range(256)) * 1024  # 256 KB
+ETAG = '"v1"'
+
+# --- ЛОКАЛЬНЫЙ СЕРВЕР ---
+# Отдаёт BODY с ETag, понимает Range/If-Range и If-None-Match.
+# cut — оборвать соединение после стольких байт тела (имитация обрыва);
+# bad_range — отвечать на Range куском не с того смещения.
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        state = self.server.state
+        state['requests'].append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range') == ETAG:
+            start = int(rng.split('=')[1].split('-')[0])
+            if state['bad_range']: start = max(0, start - 100)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(BODY) - 1}/{len(BODY)}')
+        else:
+            self.send_response(200)
+        body = BODY[start:]
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if state['cut']:
+            self.wfile.write(body[:state['cut']])
+            self.wfile.flush()
+            self.close_connection = True
+            state['cut'] = None
+            return
+        self.wfile.write(body)
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.state = {'requests': [], 'cut': None, 'bad_range': False}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/file.bin'
+        self.dest = os.path.join(self.tmp, 'file.bin')
+        self.manifest = os.path.join(self.tmp, 'fetch.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def fetcher(self, retries=0):
+        return fetch_assets.Fetcher(self.manifest, workers=2, retries=retries, timeout=5)
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_download_then_not_modified(self):
+        self.assertEqual(self.fetcher().fetch_all([(self.url, self.dest)]), {self.url: 'downloaded'})
+        self.assertEqual(self.read_dest(), BODY)
+        self.assertEqual(self.fetcher().fetch_all([(self.url, self.dest)]), {self.url: 'not-modified'})
+        self.assertEqual(self.server.state['requests'][-1].get('If-None-Match'), ETAG)
+
+    def test_resume_after_interrupted_run(self):
+        self.server.state['cut'] = 100 * 1024
+        with self.assertRaises(Exception):
+            self.fetcher().fetch(self.url, self.dest)
+        # Первый запуск оборвался до fetch_all/save_manifest — валидаторы уже на диске
+        with open(self.manifest, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)[self.url]['etag'], ETAG)
+        offset = os.path.getsize(self.dest + '.part')
+        self.assertGreater(offset, 0)
+
+        self.assertEqual(self.fetcher().fetch_all([(self.url, self.dest)]), {self.url: 'resumed'})
+        last = self.server.state['requests'][-1]
+        self.assertEqual(last.get('Range'), f'bytes={offset}-')
+        self.assertEqual(last.get('If-Range'), ETAG)
+        self.assertEqual(self.read_dest(), BODY)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_mismatched_content_range_restarts(self):
+        self.server.state['cut'] = 100 * 1024
+        with self.assertRaises(Exception):
+            self.fetcher().fetch(self.url, self.dest)
+        self.server.state['bad_range'] = True
+        # Кусок не с того смещения не дописывается: .part удаляется, повтор качает целиком
+        self.assertEqual(self.fetcher(retries=1).fetch(self.url, self.dest), 'downloaded')
+        self.assertEqual(self.read_dest(), BODY)
+
+if __name__ == '__main__':
+    unittest.main()